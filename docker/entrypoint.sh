@@ -51,6 +51,7 @@ else:
 fi
 
 nohup tram pipeline run --model logreg --run-forever &
+nohup tram pipeline run-training --run-forever &
 
 # Run Django on port 8000
 # tram runserver 0.0.0.0:8000
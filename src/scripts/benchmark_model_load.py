@@ -0,0 +1,97 @@
+"""
+Compare how long it takes to load trained models saved as a single pickle with
+the memory-mapped artifact format (see tram.ml.artifacts).
+
+Every trained model in ML_MODEL_DIR is saved in both formats to a temporary
+directory, then each copy is loaded --repeat times in a fresh subprocess so
+that the measurements include the cost of reading the files from the page cache.
+
+Usage:
+    python src/scripts/benchmark_model_load.py [--repeat N]
+"""
+
+import argparse
+import os
+import pickle
+import subprocess  # nosec
+import sys
+import tempfile
+
+import django
+
+sys.path.append("src/tram/")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tram.settings")
+django.setup()
+
+from tram.ml import artifacts, base  # noqa: E402
+
+LOAD_SCRIPT = """
+import pickle, sys, time
+sys.path.append("src/tram/")
+import django
+django.setup()
+from tram.ml import artifacts
+start = time.perf_counter()
+if sys.argv[1] == "pickle":
+    with open(sys.argv[2], "rb") as f:
+        pickle.load(f)  # nosec
+else:
+    artifacts.load(sys.argv[2])
+print(time.perf_counter() - start)
+"""
+
+
+def get_size(filepath):
+    size = os.path.getsize(filepath)
+    arrays_dir = artifacts.get_arrays_dir(filepath)
+    for dirpath, dirnames, filenames in os.walk(arrays_dir):
+        size += sum(os.path.getsize(os.path.join(dirpath, f)) for f in filenames)
+    return size
+
+
+def time_load(fmt, filepath, repeat):
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output(  # nosec
+            [sys.executable, "-c", LOAD_SCRIPT, fmt, filepath]
+        )
+        timings.append(float(output))
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        "%-28s %12s %12s %12s %12s"
+        % ("model", "pickle (s)", "mmap (s)", "pickle (MB)", "mmap (MB)")
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for model_class in base.ModelManager.model_registry.values():
+            model_filepath = base.ModelManager.get_model_filepath(model_class)
+            if not os.path.exists(model_filepath):
+                continue
+
+            model = model_class.load_from_file(model_filepath)
+            pickle_filepath = os.path.join(temp_dir, model_class.__name__ + ".pkl")
+            with open(pickle_filepath, "wb") as f:
+                pickle.dump(model, f)
+            mmap_filepath = os.path.join(temp_dir, model_class.__name__ + ".mmap")
+            artifacts.dump(model, mmap_filepath, "benchmark")
+
+            print(
+                "%-28s %12.4f %12.4f %12.2f %12.2f"
+                % (
+                    model_class.__name__,
+                    time_load("pickle", pickle_filepath, args.repeat),
+                    time_load("mmap", mmap_filepath, args.repeat),
+                    get_size(pickle_filepath) / 2**20,
+                    get_size(mmap_filepath) / 2**20,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ from tram.models import (
     Mapping,
     Report,
     Sentence,
+    TrainingJob,
 )
 
 
@@ -50,3 +51,4 @@ admin.site.register(DocumentProcessingJob)
 admin.site.register(Mapping)
 admin.site.register(Report, ReportAdmin)
 admin.site.register(Sentence, SentenceAdmin)
+admin.site.register(TrainingJob)
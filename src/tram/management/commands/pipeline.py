@@ -4,14 +4,16 @@ import time
 
 from django.contrib.auth.models import User
 from django.core.files import File
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 import tram.models as db_models
 from tram import serializers
-from tram.ml import base
+from tram.ml import base, benchmark, preprocessing
 
 ADD = "add"
+BENCH = "bench"
 RUN = "run"
+RUN_TRAINING = "run-training"
 TRAIN = "train"
 LOAD_TRAINING_DATA = "load-training-data"
 logger = logging.getLogger(__name__)
@@ -32,14 +34,81 @@ class Command(BaseCommand):
             action="store_true",
             help="Specify whether to run forever, or quit when there are no more jobs to process",
         )
+        sp_run_training = sp.add_parser(
+            RUN_TRAINING, help="Process queued model training jobs"
+        )
+        sp_run_training.add_argument(
+            "--run-forever",
+            default=False,
+            action="store_true",
+            help="Specify whether to run forever, or quit when there are no more jobs to process",
+        )
         sp_train = sp.add_parser(TRAIN, help="Train the ML Pipeline")  # noqa: F841
-        sp_train.add_argument("--model", default="logreg", help="Select the ML model.")
+        sp_train.add_argument(
+            "--model",
+            default="logreg",
+            help="Select the ML model. Use a comma-separated list or 'all' to train several models concurrently.",
+        )
+        sp_train.add_argument(
+            "--rebuild-cache",
+            default=False,
+            action="store_true",
+            help="Discard the preprocessed corpus cache and preprocess all training data",
+        )
+        sp_train.add_argument(
+            "--incremental",
+            default=False,
+            action="store_true",
+            help="Only train on mappings created since the model was last trained, if the model supports it",
+        )
+        sp_train.add_argument(
+            "--warm-start",
+            default=None,
+            action="store_true",
+            help="Start training from the saved model's weights, if the model supports it. Default: ML_WARM_START",
+        )
         sp_add = sp.add_parser(
             ADD, help="Add a document for processing by the ML pipeline"
         )
         sp_add.add_argument(
             "--file", required=True, help="Specify the file to be added"
         )
+        sp_bench = sp.add_parser(
+            BENCH, help="Benchmark processing synthetic reports with each trained model"
+        )
+        sp_bench.add_argument(
+            "--model",
+            default="all",
+            help="Select the ML models to benchmark. Use a comma-separated list or 'all'.",
+        )
+        sp_bench.add_argument(
+            "--sentences",
+            type=int,
+            default=200,
+            help="Number of sentences in each synthetic report",
+        )
+        sp_bench.add_argument(
+            "--formats",
+            default=",".join(benchmark.FORMATS),
+            help="Comma-separated list of report formats",
+        )
+        sp_bench.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Process each report this many times and keep the fastest time of each stage",
+        )
+        sp_bench.add_argument("--output", help="Write the results to this JSON file")
+        sp_bench.add_argument(
+            "--baseline",
+            help="Compare the results with a JSON file written by a previous run, and fail on regressions",
+        )
+        sp_bench.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Flag stages that are more than this fraction slower than the baseline",
+        )
         sp_load = sp.add_parser(
             LOAD_TRAINING_DATA,
             help="Load training data. Must be formatted as a Report Export.",
@@ -74,7 +143,25 @@ class Command(BaseCommand):
                 res.save(created_by=user)
             return
 
+        if subcommand == RUN_TRAINING:
+            logger.info("Running ML training worker")
+            return base.ModelManager.run_training_jobs(options["run_forever"])
+
+        if subcommand == BENCH:
+            return self.bench(options)
+
         model = options["model"]
+        if subcommand == TRAIN:
+            model_keys = self.get_model_keys(model)
+            if len(model_keys) > 1:
+                if options["incremental"]:
+                    raise CommandError(
+                        "--incremental can only be used to train a single model"
+                    )
+                return self.train_models(
+                    model_keys, options["rebuild_cache"], options["warm_start"]
+                )
+
         model_manager = base.ModelManager(model)
 
         if subcommand == RUN:
@@ -83,8 +170,59 @@ class Command(BaseCommand):
         elif subcommand == TRAIN:
             logger.info("Training ML Model: %s", model)
             start = time.time()
-            return_value = model_manager.train_model()
+            return_value = model_manager.train_model(
+                rebuild_cache=options["rebuild_cache"],
+                incremental=options["incremental"],
+                warm_start=options["warm_start"],
+            )
             end = time.time()
             elapsed = end - start
             logger.info("Trained ML model in %0.3f seconds", elapsed)
             return return_value
+
+    def get_model_keys(self, model):
+        if model == "all":
+            return list(base.ModelManager.model_registry)
+        return model.split(",")
+
+    def bench(self, options):
+        results = benchmark.run(
+            self.get_model_keys(options["model"]),
+            n_sentences=options["sentences"],
+            formats=options["formats"].split(","),
+            repeat=options["repeat"],
+        )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+            logger.info("Wrote benchmark results to %s", options["output"])
+
+        if options["baseline"]:
+            with open(options["baseline"], "r") as f:
+                baseline = json.load(f)
+            regressions = benchmark.find_regressions(
+                results, baseline, tolerance=options["tolerance"]
+            )
+            for regression in regressions:
+                logger.warning(
+                    "Regression: %(model)s %(format)s %(stage)s took %(seconds)0.4fs, "
+                    "baseline %(baseline_seconds)0.4fs",
+                    regression,
+                )
+            if regressions:
+                raise CommandError(
+                    "%d stages are slower than the baseline" % len(regressions)
+                )
+
+    def train_models(self, model_keys, rebuild_cache, warm_start=None):
+        logger.info("Training ML Models: %s", ", ".join(model_keys))
+        if rebuild_cache:
+            preprocessing.get_corpus_cache().clear()
+
+        start = time.time()
+        elapsed = base.ModelManager.train_models(model_keys, warm_start=warm_start)
+        logger.info(
+            "Trained %d ML models in %0.3f seconds", len(elapsed), time.time() - start
+        )
+        for model_key, seconds in elapsed.items():
+            logger.info("  %-10s %8.3f seconds", model_key, seconds)
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.13 on 2026-10-17 06:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tram', '0010_auto_20211209_1708'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_key', models.CharField(max_length=200)),
+                ('incremental', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('training', 'Training'), ('done', 'Done'), ('error', 'Error')], default='queued', max_length=255)),
+                ('phase', models.CharField(blank=True, default='', max_length=200)),
+                ('message', models.CharField(default='', max_length=16384)),
+                ('metrics', models.JSONField(blank=True, null=True)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('started_on', models.DateTimeField(blank=True, null=True)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
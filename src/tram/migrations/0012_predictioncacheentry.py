@@ -0,0 +1,25 @@
+# Generated by Django 3.2.13 on 2026-10-17 06:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tram', '0011_trainingjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PredictionCacheEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('model_name', models.CharField(max_length=200)),
+                ('model_version', models.CharField(max_length=200)),
+                ('mappings', models.JSONField()),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('last_used_on', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.13 on 2026-10-17 06:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tram', '0012_predictioncacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentprocessingjob',
+            name='timings',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='timings',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.13 on 2026-10-17 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tram', '0013_auto_20261017_0629'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineMetric',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('value', models.FloatField(default=0.0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='documentprocessingjob',
+            index=models.Index(fields=['status', 'created_on'], name='tram_docume_status_da2ad5_idx'),
+        ),
+    ]
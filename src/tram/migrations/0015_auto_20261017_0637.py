@@ -0,0 +1,28 @@
+# Generated by Django 3.2.13 on 2026-10-17 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tram', '0014_auto_20261017_0632'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentprocessingjob',
+            name='lease_expires_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentprocessingjob',
+            name='worker_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='documentprocessingjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('processing', 'Processing'), ('error', 'Error')], default='queued', max_length=255),
+        ),
+    ]
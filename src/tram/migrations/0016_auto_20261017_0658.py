@@ -0,0 +1,27 @@
+# Generated by Django 3.2.13 on 2026-10-17 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tram', '0015_auto_20261017_0637'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trainingjob',
+            name='lease_expires_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trainingjob',
+            name='worker_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name='trainingjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'queued')), fields=('model_key',), name='unique_queued_training_job'),
+        ),
+    ]
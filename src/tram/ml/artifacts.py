@@ -0,0 +1,143 @@
+"""
+Model artifact format with memory-mappable arrays.
+
+A model is pickled as usual, except that large numeric numpy arrays (coefficients,
+Naive Bayes log-probabilities, MLP weights, sparse matrix buffers...) are written
+to separate .npy files in a directory next to the pickle. When the model is loaded
+the arrays are memory-mapped rather than read into private memory, so loading is
+fast and processes on the same host share one physical copy of the arrays.
+
+Files are saved atomically: the arrays of each saved version go to their own
+directory and the pickle is renamed into place last, so a reader sees either the
+previous or the new model, never a partially written one.
+
+Files written by a plain pickle.dump() load unchanged.
+"""
+import os
+import pickle
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+
+# Smaller arrays are kept inline in the pickle
+MIN_ARRAY_BYTES = 1024
+
+# Copy-on-write: pages are shared until a process modifies an array in place,
+# e.g. when a loaded model is trained incrementally.
+MMAP_MODE = "c"
+
+# Number of saved versions whose arrays are kept, so that a process that is
+# loading the previous version while a new one is saved can still read it
+KEEP_VERSIONS = 2
+
+
+def get_arrays_dir(filepath):
+    return os.path.splitext(filepath)[0] + ".arrays"
+
+
+def _get_umask():
+    # The umask can only be read by setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+@contextmanager
+def atomic_open(filepath, mode="wb"):
+    """Open a temporary file that is renamed to filepath once it has been written"""
+    fd, tmp_filepath = tempfile.mkstemp(
+        dir=os.path.dirname(filepath) or ".",
+        prefix=os.path.basename(filepath) + ".",
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        # mkstemp() creates the file readable by its owner only; give it the mode
+        # that open() would, so processes running as other users can read it
+        os.chmod(tmp_filepath, 0o666 & ~_get_umask())
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        os.remove(tmp_filepath)
+        raise
+
+
+class _ArtifactPickler(pickle.Pickler):
+    def __init__(self, file, arrays_dir, version):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.arrays_dir = arrays_dir
+        self.version = version
+        self.saved_arrays = {}  # id(array) -> path relative to arrays_dir
+
+    def persistent_id(self, obj):
+        if (
+            not isinstance(obj, np.ndarray)
+            or obj.dtype.hasobject
+            or obj.nbytes < MIN_ARRAY_BYTES
+        ):
+            return None
+
+        relpath = self.saved_arrays.get(id(obj))
+        if relpath is None:
+            relpath = "%s/%d.npy" % (self.version, len(self.saved_arrays))
+            np.save(os.path.join(self.arrays_dir, relpath), obj, allow_pickle=False)
+            self.saved_arrays[id(obj)] = relpath
+        return ("ndarray", relpath)
+
+
+class _ArtifactUnpickler(pickle.Unpickler):
+    def __init__(self, file, arrays_dir, mmap_mode):
+        super().__init__(file)
+        self.arrays_dir = arrays_dir
+        self.mmap_mode = mmap_mode
+
+    def persistent_load(self, pid):
+        kind, relpath = pid
+        if kind != "ndarray":
+            raise pickle.UnpicklingError("Unsupported persistent id: %s" % kind)
+        return np.load(
+            os.path.join(self.arrays_dir, *relpath.split("/")),
+            mmap_mode=self.mmap_mode,
+            allow_pickle=False,
+        )
+
+
+def dump(obj, filepath, version):
+    """
+    Pickle obj to filepath, storing its large arrays in a sibling directory.
+
+    :param version: A unique identifier for this save, used to name the directory
+                    that holds this version's arrays
+    """
+    arrays_dir = get_arrays_dir(filepath)
+    os.makedirs(os.path.join(arrays_dir, version))
+    with atomic_open(filepath) as f:
+        _ArtifactPickler(f, arrays_dir, version).dump(obj)
+    _remove_old_versions(arrays_dir)
+
+
+def _remove_old_versions(arrays_dir):
+    entries = sorted(
+        (entry for entry in os.scandir(arrays_dir)),
+        key=lambda entry: entry.stat().st_mtime_ns,
+        reverse=True,
+    )
+    for entry in entries[KEEP_VERSIONS:]:
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+
+
+def load(filepath, mmap_mode=MMAP_MODE):
+    """
+    Load an object saved with dump() or pickle.dump().
+
+    :param mmap_mode: passed to numpy.load(); None reads the arrays into memory
+    """
+    with open(filepath, "rb") as f:
+        unpickler = _ArtifactUnpickler(f, get_arrays_dir(filepath), mmap_mode)
+        # accept risk until better design implemented
+        return unpickler.load()  # nosec
@@ -1,34 +1,51 @@
+import copy
+import hashlib
+import json
 import logging
+import os
 import pathlib
 import pickle
-import re
+import socket
+import threading
 import time
+import uuid
 from abc import ABC, abstractmethod
-from datetime import datetime, timezone
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
 from os import path
 
+import django
 import docx
 import nltk
+import numpy as np
 import pdfplumber
 from bs4 import BeautifulSoup
 from constance import config
 from django.conf import settings
-from django.db import transaction
+from django.db import connections, transaction
+from django.db.models import Q
+from sklearn.base import BaseEstimator, ClassifierMixin, clone
 from sklearn.dummy import DummyClassifier
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.linear_model import LogisticRegression
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.metrics import f1_score
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import StratifiedKFold, cross_val_predict, train_test_split
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.neural_network import MLPClassifier
 from sklearn.pipeline import Pipeline
 
 # The word model is overloaded in this scope, so a prefix is necessary
 from tram import models as db_models
+from tram.ml import artifacts, metrics, preprocessing, wakeup
 
 logger = logging.getLogger(__name__)
 
+# Keeps IN (...) queries under SQLite's limit on query parameters
+IN_QUERY_BATCH_SIZE = 500
+
 
 class Sentence(object):
     def __init__(self, text, order, mappings):
@@ -57,6 +74,62 @@ class ExtractionError(Exception):
     """An error that happens while extracting text from a source."""
 
 
+class ClaimLostError(Exception):
+    """A job was reclaimed by another worker while it was being processed."""
+
+
+class PhaseTimer(object):
+    """
+    Records the wall clock time spent in each named phase of an operation.
+
+    :param on_phase: An optional callable that is passed the name of each phase as
+                     it starts, and again at each heartbeat() during the phase, e.g.
+                     to report progress
+    """
+
+    def __init__(self, on_phase=None):
+        self.timings = {}  # phase name -> seconds, in the order phases were started
+        self.counters = {}  # e.g. the number of items processed
+        self.on_phase = on_phase
+        self.current_phase = None
+
+    @contextmanager
+    def phase(self, name):
+        if self.on_phase:
+            self.on_phase(name)
+        self.current_phase = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            self.current_phase = None
+
+    def heartbeat(self):
+        """Called as a long phase makes progress, e.g. after each chunk of sentences"""
+        if self.on_phase and self.current_phase:
+            self.on_phase(self.current_phase)
+
+    def as_dict(self):
+        """Returns the timings and counters as a JSON-serializable dict"""
+        return {
+            "seconds": dict(self.timings),
+            "total_seconds": sum(self.timings.values()),
+            **self.counters,
+        }
+
+    def __str__(self):
+        return ", ".join(
+            "%s=%0.3fs" % (name, seconds) for name, seconds in self.timings.items()
+        )
+
+
+# Classifiers for which fitting rows weighted by their counts is exact, see
+# SKLearnModel.supports_compacted_training()
+COMPACTED_TRAINING_CLASSIFIERS = (DummyClassifier, LogisticRegression, MultinomialNB)
+
+
 class SKLearnModel(ABC):
     """
     TODO:
@@ -65,7 +138,10 @@ class SKLearnModel(ABC):
 
     def __init__(self):
         self.techniques_model = self.get_model()
+        self.version = None  # Set when the model is saved
         self.last_trained = None
+        self.fit_stats = None  # Iterations and seconds taken by the last fit
+        self.cold_fit_stats = None  # The same for the last fit from scratch
         self.average_f1_score = None
         self.detailed_f1_score = None
 
@@ -78,45 +154,393 @@ class SKLearnModel(ABC):
     def get_model(self):
         """Returns an sklearn.Pipeline that has fit() and predict() methods"""
 
-    def train(self):
+    def train(self, X=None, y=None, features=None, timer=None, warm_start_from=None):
         """
         Load and preprocess data. Train model pipeline
-        """
-        X, y = self.get_training_data()
 
-        self.techniques_model.fit(X, y)  # Train classification model
+        X and y can be passed in if the training data has already been loaded, and
+        features if X has already been vectorized by the (stateless) feature stage.
+
+        If ML_TRAIN_CHUNK_SIZE is set and the model supports it, the model is fit
+        in chunks of that many rows. See supports_chunked_training().
+
+        If warm_start_from is a previously trained model of the same type, the
+        classifier's solver starts from that model's weights when possible. See
+        warm_start_classifier().
+
+        If ML_COMPACT_TRAINING_DATA is set and fitting weighted rows is exact for the
+        classifier, identical (sentence, technique) rows are fit as a single weighted
+        row. See supports_compacted_training().
+        """
+        timer = timer or PhaseTimer()
+        if X is None:
+            X, y = self.get_training_data(timer=timer)
+
+        chunk_size = settings.ML_TRAIN_CHUNK_SIZE
+        if features is None and chunk_size and self.supports_chunked_training():
+            with timer.phase("fit"):
+                self.fit_in_chunks(X, y, chunk_size)
+        else:
+            # Equivalent to Pipeline.fit(), split up so each step can be timed
+            if features is None:
+                with timer.phase("vectorize"):
+                    features = self.techniques_model[:-1].fit_transform(X, y)
+            # Compacting after vectorizing leaves the learned vocabulary unchanged
+            sample_weight = None
+            if settings.ML_COMPACT_TRAINING_DATA and self.supports_compacted_training():
+                rows, sample_weight = self.compact_rows(X, y)
+                logger.info(
+                    "Compacted %d training rows to %d weighted rows",
+                    len(y),
+                    len(rows),
+                )
+                features, y = features[rows], [y[row] for row in rows]
+            classifier = None
+            if warm_start_from is not None:
+                classifier = self.warm_start_classifier(warm_start_from, y)
+            with timer.phase("fit"):
+                self._fit_classifier(
+                    features, y, sample_weight, classifier, warm_start_from
+                )
         self.last_trained = datetime.now(timezone.utc)
 
-    def test(self):
+    def supports_compacted_training(self):
+        """
+        True if fitting the classifier on compacted rows gives the same model as
+        fitting it on all of the rows. That holds for classifiers whose fit only
+        depends on weighted sums over the rows (counts, or a full-batch loss).
+        Stochastic solvers such as SGDClassifier and MLPClassifier visit rows one
+        mini-batch at a time, so a weighted row is a different sample order and step
+        size than its copies, and are fit on all of the rows instead.
+        """
+        classifier = self.techniques_model.steps[-1][1]
+        return isinstance(classifier, COMPACTED_TRAINING_CLASSIFIERS)
+
+    @staticmethod
+    def compact_rows(X, y):
+        """
+        Collapses identical (x, label) pairs. Returns the index of the first row of
+        each distinct pair, and an array with the number of rows of each pair, to be
+        used as sample weights. For the classifiers in COMPACTED_TRAINING_CLASSIFIERS,
+        fitting the first rows with these weights is equivalent to fitting all of the
+        rows.
+        """
+        pairs = {}  # (x, label) -> [first row, count]
+        for row, pair in enumerate(zip(X, y)):
+            if pair in pairs:
+                pairs[pair][1] += 1
+            else:
+                pairs[pair] = [row, 1]
+        rows = np.array([row for row, count in pairs.values()], dtype=int)
+        counts = np.array([count for row, count in pairs.values()], dtype=float)
+        return rows, counts
+
+    def _fit_classifier(
+        self, features, y, sample_weight=None, warm_classifier=None, previous=None
+    ):
+        if warm_classifier is not None:
+            self.techniques_model.steps[-1] = ("clf", warm_classifier)
+        classifier = self.techniques_model.steps[-1][1]
+
+        start = time.perf_counter()
+        if sample_weight is None:
+            classifier.fit(features, y)
+        else:
+            classifier.fit(features, y, sample_weight=sample_weight)
+        n_iter = getattr(classifier, "n_iter_", None)
+        previous_fit_stats = getattr(self, "fit_stats", None)
+        self.fit_stats = {
+            "warm_start": warm_classifier is not None,
+            "n_iter": None if n_iter is None else int(np.max(n_iter)),
+            "rows": features.shape[0],
+            "seconds": time.perf_counter() - start,
+        }
+        if previous_fit_stats and "rows" in previous_fit_stats:
+            logger.info(
+                "Fit %d rows in %0.3fs; the previous fit took %0.3fs for %d rows",
+                self.fit_stats["rows"],
+                self.fit_stats["seconds"],
+                previous_fit_stats["seconds"],
+                previous_fit_stats["rows"],
+            )
+
+        if warm_classifier is None:
+            self.cold_fit_stats = self.fit_stats
+            return
+
+        # Don't let the next fit of this model continue from these weights
+        classifier.set_params(warm_start=False)
+        self.cold_fit_stats = getattr(previous, "cold_fit_stats", None)
+        cold = self.cold_fit_stats or {"n_iter": None, "seconds": None}
+        logger.info(
+            "Warm-started fit took %s iterations in %0.3fs; "
+            "the last cold fit took %s iterations in %s",
+            self.fit_stats["n_iter"],
+            self.fit_stats["seconds"],
+            cold["n_iter"] if cold["n_iter"] is not None else "?",
+            "%0.3fs" % cold["seconds"] if cold["seconds"] is not None else "?",
+        )
+
+    def supports_warm_start(self):
+        """True if the classifier's solver can start from previously fitted weights"""
+        return "warm_start" in self.techniques_model.steps[-1][1].get_params()
+
+    def warm_start_classifier(self, previous, y):
+        """
+        Returns a copy of previous's fitted classifier, set up to continue training
+        from its weights on labels y with this model's fitted feature stage. Returns
+        None if a cold fit is needed: if the classifier doesn't support warm starts,
+        if previous isn't trained, or if its techniques differ from the labels in y.
+
+        When both feature stages learn a vocabulary, the weights of terms that are in
+        both vocabularies are carried over and new terms start at zero.
+        """
+        name = self.__class__.__name__
+        if not self.supports_warm_start():
+            logger.info("%s does not support warm starts; fitting from scratch", name)
+            return None
+        if type(previous) is not type(self) or previous.last_trained is None:
+            logger.info("No trained %s to warm start from; fitting from scratch", name)
+            return None
+
+        previous_classifier = previous.techniques_model.steps[-1][1]
+        if not np.array_equal(np.unique(y), previous_classifier.classes_):
+            logger.info("Techniques have changed; fitting %s from scratch", name)
+            return None
+
+        old_index, new_index, n_features = self._match_features(previous)
+        if n_features is None:
+            logger.info("Features are incompatible; fitting %s from scratch", name)
+            return None
+
+        classifier = copy.deepcopy(previous_classifier)
+        if isinstance(classifier, MLPClassifier):
+            weights = np.zeros((n_features, classifier.coefs_[0].shape[1]))
+            weights[new_index] = classifier.coefs_[0][old_index]
+            classifier.coefs_[0] = weights
+            # Measure convergence on the new data, not against the previous fit
+            classifier.n_iter_ = 0
+            classifier.best_loss_ = np.inf
+            classifier._no_improvement_count = 0
+        else:
+            weights = np.zeros((classifier.coef_.shape[0], n_features))
+            weights[:, new_index] = classifier.coef_[:, old_index]
+            classifier.coef_ = weights
+            classifier.intercept_ = np.array(classifier.intercept_)
+        classifier.n_features_in_ = n_features
+        classifier.set_params(**self.techniques_model.steps[-1][1].get_params())
+        classifier.set_params(warm_start=True)
+        logger.info(
+            "Warm starting %s with %d of %d features carried over",
+            name,
+            len(new_index),
+            n_features,
+        )
+        return classifier
+
+    def _match_features(self, previous):
+        """
+        Returns the indices of the features of previous's feature stage, the indices
+        of the same features in this model's fitted feature stage, and this model's
+        number of features. The number of features is None if they can't be matched.
+        """
+        old_features = previous.techniques_model.steps[0][1]
+        new_features = self.techniques_model.steps[0][1]
+        if hasattr(old_features, "vocabulary_") and hasattr(
+            new_features, "vocabulary_"
+        ):
+            common = [
+                (old_features.vocabulary_[term], index)
+                for term, index in new_features.vocabulary_.items()
+                if term in old_features.vocabulary_
+            ]
+            old_index = np.array([old for old, new in common], dtype=int)
+            new_index = np.array([new for old, new in common], dtype=int)
+            return old_index, new_index, len(new_features.vocabulary_)
+
+        n_features = getattr(new_features, "n_features", None)
+        if n_features is not None and n_features == getattr(
+            old_features, "n_features", None
+        ):
+            index = np.arange(n_features)
+            return index, index, n_features
+        return None, None, None
+
+    def train_and_test(self, X=None, y=None, timer=None, warm_start_from=None):
+        """
+        Evaluate the model, then train it on all of the training data.
+
+        The corpus is loaded and preprocessed once (unless X and y are passed in)
+        and shared by test() and train(). When the feature stage is stateless it
+        is also vectorized once.
+
+        warm_start_from is passed to train(). Evaluation always fits from scratch,
+        since the previous model has seen the evaluation data.
+        """
+        timer = timer or PhaseTimer()
+        if X is None:
+            X, y = self.get_training_data(timer=timer)
+
+        features = None
+        if self.has_stateless_features() and not settings.ML_TRAIN_CHUNK_SIZE:
+            with timer.phase("vectorize"):
+                features = self.techniques_model[:-1].transform(X)
+
+        self.test(X, y, features=features, timer=timer)
+        self.train(
+            X, y, features=features, timer=timer, warm_start_from=warm_start_from
+        )
+
+    def supports_incremental_training(self):
+        """True if the classifier can be updated with partial_fit()"""
+        return hasattr(self.techniques_model.steps[-1][1], "partial_fit")
+
+    def has_stateless_features(self):
+        """True if the feature stage doesn't need to be fit, e.g. a HashingVectorizer"""
+        return isinstance(self.techniques_model.steps[0][1], HashingVectorizer)
+
+    def supports_chunked_training(self):
+        """True if the model can be fit a chunk of the training data at a time"""
+        return self.has_stateless_features() and self.supports_incremental_training()
+
+    def fit_in_chunks(self, X, y, chunk_size):
+        """
+        Fit the model with partial_fit(), vectorizing chunk_size rows at a time so
+        that the whole feature matrix is never held in memory.
+
+        For MultinomialNB this is equivalent to fit(). Other classifiers make a
+        single pass over the data. Like fit(), this starts from an unfitted
+        classifier, so retraining a trained model doesn't add to what it learned.
+        """
+        features = self.techniques_model[:-1]
+        name, classifier = self.techniques_model.steps[-1]
+        classifier = clone(classifier)
+        classes = sorted(set(y))
+        for start in range(0, len(X), chunk_size):
+            chunk_features = features.transform(X[start : start + chunk_size])
+            classifier.partial_fit(
+                chunk_features, y[start : start + chunk_size], classes=classes
+            )
+        self.techniques_model.steps[-1] = (name, classifier)
+
+    def train_incremental(self):
+        """
+        Update the trained model with the mappings created since it was last trained.
+
+        Only the classifier is updated with partial_fit(); the fitted feature stage is
+        reused as is, and mappings to techniques that the model was not trained on
+        are skipped. Changes to mappings and sentences that the model was already
+        trained on are only picked up by a full train(). Evaluation scores are left
+        unchanged, so run a full train() and test() periodically.
+        """
+        if not self.supports_incremental_training():
+            raise ValueError(
+                "%s does not support incremental training" % self.__class__.__name__
+            )
+        if self.last_trained is None:
+            raise ValueError(
+                "%s must be trained before it can be trained incrementally"
+                % self.__class__.__name__
+            )
+
+        trained_at = datetime.now(timezone.utc)
+        X, y = self.get_training_data(since=self.last_trained)
+
+        classifier = self.techniques_model.steps[-1][1]
+        known_techniques = set(classifier.classes_)
+        rows = [(x, label) for x, label in zip(X, y) if label in known_techniques]
+        if len(rows) < len(X):
+            logger.warning(
+                "Skipped %d mappings to techniques the model was not trained on",
+                len(X) - len(rows),
+            )
+
+        if rows:
+            X_new, y_new = zip(*rows)
+            features = self.techniques_model[:-1].transform(X_new)
+            classifier.partial_fit(features, y_new)
+        logger.info("Incrementally trained on %d new mappings", len(rows))
+        self.last_trained = trained_at
+
+    def test(self, X=None, y=None, features=None, timer=None, folds=None, n_jobs=None):
         """
         Return classification metrics based on train/test evaluation of the data
-        Note: potential extension is to use cross-validation rather than a single train/test split
+
+        By default the metrics come from a single 80/20 train/test split. If folds
+        (default: ML_EVALUATION_FOLDS) is greater than 1, stratified k-fold
+        cross-validation is used instead, and the metrics are computed from the
+        out-of-fold predictions for every row. The folds are fit in parallel on
+        n_jobs (default: ML_EVALUATION_N_JOBS) processes.
+
+        X, y and features can be passed in as for train().
         """
-        x, y = self.get_training_data()
+        timer = timer or PhaseTimer()
+        if X is None:
+            X, y = self.get_training_data(timer=timer)
+        if folds is None:
+            folds = settings.ML_EVALUATION_FOLDS
+        if n_jobs is None:
+            n_jobs = settings.ML_EVALUATION_N_JOBS
+
+        with timer.phase("evaluate"):
+            if folds and folds > 1:
+                y_test, y_predicted = self._cross_validation_predictions(
+                    X, y, features, folds, n_jobs
+                )
+            else:
+                y_test, y_predicted = self._holdout_predictions(X, y, features)
+
+            # TODO: Does this put labels and scores in the correct order?
+            # Calculate an f1 score for each technique
+            labels = sorted(list(set(y)))
+            scores = f1_score(y_test, y_predicted, labels=list(set(y)), average=None)
+            self.detailed_f1_score = sorted(
+                zip(labels, scores), key=lambda t: t[1], reverse=True
+            )
 
-        # Create training set and test set
-        x_train, x_test, y_train, y_test = train_test_split(
-            x, y, test_size=0.2, shuffle=True, random_state=0, stratify=y
+            # Average F1 score across techniques, weighted by the # of training examples per technique
+            weighted_f1 = f1_score(y_test, y_predicted, average="weighted")
+            self.average_f1_score = weighted_f1
+
+    def _holdout_predictions(self, X, y, features=None):
+        """Returns the true and predicted labels of a stratified 20% test set"""
+        # Create training set and test set. Splitting the row indices gives the
+        # same split as splitting X, and also works for a feature matrix.
+        train_rows, test_rows, y_train, y_test = train_test_split(
+            np.arange(len(y)),
+            y,
+            test_size=0.2,
+            shuffle=True,
+            random_state=0,
+            stratify=y,
         )
 
         # Train model
         test_model = self.get_model()
-        test_model.fit(x_train, y_train)
+        if features is None:
+            test_model.fit([X[i] for i in train_rows], y_train)
+            # Generate predictions on test set
+            y_predicted = test_model.predict([X[i] for i in test_rows])
+        else:
+            classifier = test_model.steps[-1][1]
+            classifier.fit(features[train_rows], y_train)
+            y_predicted = classifier.predict(features[test_rows])
 
-        # Generate predictions on test set
-        y_predicted = test_model.predict(x_test)
+        return y_test, y_predicted
 
-        # TODO: Does this put labels and scores in the correct order?
-        # Calculate an f1 score for each technique
-        labels = sorted(list(set(y)))
-        scores = f1_score(y_test, y_predicted, labels=list(set(y)), average=None)
-        self.detailed_f1_score = sorted(
-            zip(labels, scores), key=lambda t: t[1], reverse=True
-        )
+    def _cross_validation_predictions(self, X, y, features, folds, n_jobs):
+        """Returns the true labels and the out-of-fold predictions for every row"""
+        cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=0)
+        test_model = self.get_model()
+        if features is None:
+            y_predicted = cross_val_predict(test_model, X, y, cv=cv, n_jobs=n_jobs)
+        else:
+            classifier = test_model.steps[-1][1]
+            y_predicted = cross_val_predict(
+                classifier, features, y, cv=cv, n_jobs=n_jobs
+            )
 
-        # Average F1 score across techniques, weighted by the # of training examples per technique
-        weighted_f1 = f1_score(y_test, y_predicted, average="weighted")
-        self.average_f1_score = weighted_f1
+        return y, y_predicted
 
     def _get_report_name(self, job):
         name = pathlib.Path(job.document.docfile.path).name
@@ -142,33 +566,90 @@ class SKLearnModel(ABC):
         Preprocess text by
         1) Lemmatizing - reducing words to their root, as a way to eliminate noise in the text
         2) Removing digits
+
+        Uses the process-wide lemmatizer, so WordNet lookups are cached across calls.
         """
-        lemma = nltk.stem.WordNetLemmatizer()
+        return preprocessing.get_lemmatizer().lemmatize(sentence)
+
+    def get_training_data(self, since=None, timer=None):
+        """
+        returns a tuple of lists, X, y.
+        X is a list of lemmatized sentences; y is a list of Attack Techniques
+
+        Lemmatized sentences are kept in a corpus cache under ML_MODEL_DIR, so only
+        sentences that are new or were updated since the last call are preprocessed,
+        and only their text is read from the database. Loading takes one query to
+        read the ML_ACCEPT_THRESHOLD setting, one query that streams the accepted
+        mappings, and one query per IN_QUERY_BATCH_SIZE sentences that must be
+        preprocessed; see _load_training_rows().
 
-        # Lemmatize each word in sentence
-        lemmatized_sentence = " ".join(
-            [lemma.lemmatize(w) for w in sentence.rstrip().split()]
+        since - Only return the mappings created after this datetime
+        timer - A PhaseTimer that records the load and preprocess phases
+        """
+        timer = timer or PhaseTimer()
+        corpus_cache = preprocessing.get_corpus_cache()
+        with timer.phase("load"):
+            sentences, sentence_ids, y = self._load_training_rows(since, corpus_cache)
+
+        with timer.phase("preprocess"):
+            lemmatized = corpus_cache.preprocess(
+                sentences,
+                workers=settings.ML_PREPROCESS_WORKERS,
+                chunk_size=settings.ML_PREPROCESS_CHUNK_SIZE,
+                prune=since is None,
+            )
+            corpus_cache.save()
+        logger.debug(
+            "Lemmatizer cache: %s", preprocessing.get_lemmatizer().cache_info()
         )
-        lemmatized_sentence = re.sub(
-            r"\d+", "", lemmatized_sentence
-        )  # Remove digits with regex
 
-        return lemmatized_sentence
+        X = [lemmatized[sentence_id] for sentence_id in sentence_ids]
+        return X, y
 
-    def get_training_data(self):
+    def _load_training_rows(self, since=None, corpus_cache=None):
         """
-        returns a tuple of lists, X, y.
-        X is a list of lemmatized sentences; y is a list of Attack Techniques
+        Returns the accepted mappings as a dict of sentence id -> (updated_on, text),
+        plus parallel lists of each mapping's sentence id and Attack Technique.
+
+        Only the columns that are needed are read, and the mappings are streamed
+        ML_TRAINING_LOAD_CHUNK_SIZE rows at a time rather than materialized as model
+        instances. The text of a sentence is only read if it is missing from
+        corpus_cache or out of date, in batches of IN_QUERY_BATCH_SIZE; the text of
+        the other sentences is None.
         """
-        X = []
+        rows = (
+            db_models.Mapping.get_accepted_mappings(since=since)
+            .order_by("id")
+            .values_list(
+                "sentence_id", "sentence__updated_on", "attack_object__attack_id"
+            )
+            .iterator(chunk_size=settings.ML_TRAINING_LOAD_CHUNK_SIZE)
+        )
+        updated_on = {}
+        sentence_ids = []
         y = []
-        mappings = db_models.Mapping.get_accepted_mappings()
-        for mapping in mappings:
-            lemmatized_sentence = self.lemmatize(mapping.sentence.text)
-            X.append(lemmatized_sentence)
-            y.append(mapping.attack_object.attack_id)
+        for sentence_id, sentence_updated_on, attack_id in rows:
+            updated_on[sentence_id] = sentence_updated_on.isoformat()
+            sentence_ids.append(sentence_id)
+            y.append(attack_id)
 
-        return X, y
+        if corpus_cache is None:
+            stale_ids = list(updated_on)
+        else:
+            stale_ids = corpus_cache.get_stale_ids(updated_on)
+        texts = {}
+        for start in range(0, len(stale_ids), IN_QUERY_BATCH_SIZE):
+            texts.update(
+                db_models.Sentence.objects.filter(
+                    id__in=stale_ids[start : start + IN_QUERY_BATCH_SIZE]
+                ).values_list("id", "text")
+            )
+
+        sentences = {
+            sentence_id: (sentence_updated_on, texts.get(sentence_id))
+            for sentence_id, sentence_updated_on in updated_on.items()
+        }
+        return sentences, sentence_ids, y
 
     def get_attack_object_ids(self):
         objects = [
@@ -185,25 +666,67 @@ class SKLearnModel(ABC):
         """
         Use trained model to predict the technique for a given sentence.
         """
-        mappings = []
+        return self.get_mappings_for_sentences([sentence])[0]
+
+    def get_mappings_for_sentences(self, sentences, chunk_size=None, on_chunk=None):
+        """
+        Use trained model to predict the techniques for a list of sentences.
+
+        The sentences are scored as a matrix with a single predict_proba() call per
+        chunk of `chunk_size` sentences (or one call for all of them if chunk_size is
+        not set), rather than one pipeline call per sentence. If set, `on_chunk` is
+        called after each chunk is scored.
+
+        Returns a list with one list of Mapping objects per sentence.
+        """
+        all_mappings = []
+        if not chunk_size:
+            chunk_size = max(len(sentences), 1)
 
         techniques = self.techniques_model.classes_
-        probs = self.techniques_model.predict_proba([sentence])[
-            0
-        ]  # Probability is a range between 0-1
-
-        # Create a list of tuples of (confidence, technique)
-        confidences_and_techniques = zip(probs, techniques)
-        for confidence_and_technique in confidences_and_techniques:
-            confidence = confidence_and_technique[0] * 100
-            attack_technique = confidence_and_technique[1]
-            if confidence < config.ML_CONFIDENCE_THRESHOLD:
-                # Ignore proposed mappings below the confidence threshold
-                continue
-            mapping = Mapping(confidence, attack_technique)
-            mappings.append(mapping)
+        threshold = config.ML_CONFIDENCE_THRESHOLD
+        max_mappings = config.ML_MAX_MAPPINGS_PER_SENTENCE
+        for start in range(0, len(sentences), chunk_size):
+            chunk = sentences[start : start + chunk_size]
+            # Probability is a range between 0-1
+            chunk_probs = self.techniques_model.predict_proba(chunk)
+            all_mappings.extend(
+                self._select_mappings(chunk_probs, techniques, threshold, max_mappings)
+            )
+            if on_chunk:
+                on_chunk()
+
+        return all_mappings
+
+    def get_prediction_settings(self):
+        """Returns the settings that change the mappings proposed for a sentence"""
+        return [config.ML_CONFIDENCE_THRESHOLD, config.ML_MAX_MAPPINGS_PER_SENTENCE]
 
-        return mappings
+    def _select_mappings(self, probs, techniques, threshold, max_mappings=0):
+        """
+        Select the proposed mappings from a matrix of predict_proba() output.
+
+        A mapping is kept when its confidence is at or above `threshold`. If
+        `max_mappings` is set, only the `max_mappings` most confident techniques of
+        each sentence are considered. The selection is done on the whole matrix at
+        once; mappings are returned in class order, one list per row of `probs`.
+        """
+        confidences = np.asarray(probs) * 100
+        keep = confidences >= threshold
+
+        if max_mappings and max_mappings < confidences.shape[1]:
+            # Ignore everything outside of the top-k techniques for each sentence
+            top_k = np.argpartition(-confidences, max_mappings - 1, axis=1)
+            in_top_k = np.zeros_like(keep)
+            np.put_along_axis(in_top_k, top_k[:, :max_mappings], True, axis=1)
+            keep &= in_top_k
+
+        all_mappings = [[] for _ in range(confidences.shape[0])]
+        for row, column in zip(*np.nonzero(keep)):
+            mapping = Mapping(confidences[row, column], techniques[column])
+            all_mappings[row].append(mapping)
+
+        return all_mappings
 
     def _sentence_tokenize(self, text):
         return nltk.sent_tokenize(text)
@@ -236,15 +759,35 @@ class SKLearnModel(ABC):
         text = document.docfile.read().decode("UTF-8")
         return text
 
-    def process_job(self, job):
+    def process_job(self, job, timer=None):
+        """
+        Extract, tokenize and classify the sentences of job's document.
+
+        :param timer: An optional PhaseTimer that records the extract, tokenize and
+                      classify phases and counts the sentences
+        """
+        timer = timer or PhaseTimer()
         name = self._get_report_name(job)
-        text = self._extract_text(job.document)
-        sentences = self._sentence_tokenize(text)
+        with timer.phase("extract"):
+            text = self._extract_text(job.document)
+        with timer.phase("tokenize"):
+            sentences = self._sentence_tokenize(text)
+        timer.counters["sentences"] = len(sentences)
+
+        with timer.phase("classify"):
+            if settings.ML_PREDICTION_CACHE_SIZE and getattr(self, "version", None):
+                prediction_cache = PredictionCache(settings.ML_PREDICTION_CACHE_SIZE)
+                all_mappings = prediction_cache.get_mappings(
+                    self, sentences, settings.ML_INFERENCE_CHUNK_SIZE, timer.heartbeat
+                )
+            else:
+                all_mappings = self.get_mappings_for_sentences(
+                    sentences, settings.ML_INFERENCE_CHUNK_SIZE, timer.heartbeat
+                )
 
         report_sentences = []
         order = 0
-        for sentence in sentences:
-            mappings = self.get_mappings(sentence)
+        for sentence, mappings in zip(sentences, all_mappings):
             s = Sentence(text=sentence, order=order, mappings=mappings)
             order += 1
             report_sentences.append(s)
@@ -252,15 +795,51 @@ class SKLearnModel(ABC):
         report = Report(name, text, report_sentences)
         return report
 
+    def get_metadata(self):
+        """Returns the training date and evaluation scores as a JSON-serializable dict"""
+        metadata = {
+            "name": self.__class__.__name__,
+            # Models saved before versioning was introduced have no version
+            "version": getattr(self, "version", None),
+            "last_trained": None,
+            "average_f1_score": None,
+            "detailed_f1_score": None,
+        }
+        if self.last_trained is not None:
+            metadata["last_trained"] = self.last_trained.isoformat()
+        if self.average_f1_score is not None:
+            metadata["average_f1_score"] = float(self.average_f1_score)
+        if self.detailed_f1_score is not None:
+            metadata["detailed_f1_score"] = [
+                [attack_id, float(score)] for attack_id, score in self.detailed_f1_score
+            ]
+        return metadata
+
     def save_to_file(self, filepath):
-        with open(filepath, "wb") as f:
-            pickle.dump(self, f)
+        """
+        Save the model to filepath and give it a new version identifier. The file is
+        replaced atomically. If ML_MODEL_MMAP is set, the model's large arrays are
+        stored so that they can be memory-mapped when loaded; see tram.ml.artifacts
+        """
+        # stop_words_ is only provided for introspection and can be larger than the
+        # rest of the model, see sklearn.feature_extraction.text.CountVectorizer
+        for _, step in self.techniques_model.steps:
+            if hasattr(step, "stop_words_"):
+                step.stop_words_ = None
+
+        self.version = "%s-%s" % (
+            datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S"),
+            uuid.uuid4().hex[:8],
+        )
+        if settings.ML_MODEL_MMAP:
+            artifacts.dump(self, filepath, self.version)
+        else:
+            with artifacts.atomic_open(filepath) as f:
+                pickle.dump(self, f)
 
     @classmethod
     def load_from_file(cls, filepath):
-        with open(filepath, "rb") as f:
-            model = pickle.load(f)  # nosec
-            # accept risk until better design implemented
+        model = artifacts.load(filepath)
         assert cls == model.__class__
         return model
 
@@ -332,37 +911,436 @@ class MLPClassifierModel(SKLearnModel):
         )
 
 
+def get_hashing_features():
+    """
+    Document-term features computed with the hashing trick, with stop words removed.
+
+    Unlike CountVectorizer there is no vocabulary to learn or store, so the size of
+    the model depends on ML_HASHING_N_FEATURES rather than on the training data.
+    """
+    return HashingVectorizer(
+        lowercase=True,
+        stop_words="english",
+        n_features=settings.ML_HASHING_N_FEATURES,
+        alternate_sign=False,  # Keep counts non-negative for MultinomialNB
+        norm=None,
+    )
+
+
+class NaiveBayesHashingModel(SKLearnModel):
+    def get_model(self):
+        """
+        Modeling pipeline:
+        1) Features = hashed document-term matrix, with stop words removed.
+        2) Classifier (clf) = multinomial Naive Bayes
+        """
+        return Pipeline(
+            [
+                ("features", get_hashing_features()),
+                ("clf", MultinomialNB()),
+            ]
+        )
+
+
+class SGDHashingModel(SKLearnModel):
+    def get_model(self):
+        """
+        Modeling pipeline:
+        1) Features = hashed document-term matrix, with stop words removed.
+        2) Classifier (clf) = linear model trained with stochastic gradient descent
+        """
+        return Pipeline(
+            [
+                ("features", get_hashing_features()),
+                # modified_huber is a smooth loss that supports predict_proba()
+                ("clf", SGDClassifier(loss="modified_huber", random_state=0)),
+            ]
+        )
+
+
+class CascadeClassifier(BaseEstimator, ClassifierMixin):
+    """
+    A two-stage classifier: a fast screen scores every row, and only the rows whose
+    best screen probability is at or above gate are scored by the (slower) model.
+    The other rows keep the screen's probabilities.
+
+    n_screened_ and n_routed_ count the rows seen by each stage since the counters
+    were last reset with reset_routing_counts().
+    """
+
+    def __init__(self, screen, model, gate=0.25):
+        self.screen = screen
+        self.model = model
+        self.gate = gate
+
+    def fit(self, X, y):
+        self.screen_ = clone(self.screen).fit(X, y)
+        self.model_ = clone(self.model).fit(X, y)
+        self.classes_ = self.model_.classes_
+        self.reset_routing_counts()
+        return self
+
+    def reset_routing_counts(self):
+        self.n_screened_ = 0
+        self.n_routed_ = 0
+
+    def predict_proba(self, X):
+        probs = self.screen_.predict_proba(X)
+        routed_rows = np.flatnonzero(probs.max(axis=1) >= self.gate)
+        if len(routed_rows):
+            probs[routed_rows] = self.model_.predict_proba(X[routed_rows])
+
+        self.n_screened_ += probs.shape[0]
+        self.n_routed_ += len(routed_rows)
+        return probs
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+class CascadeModel(SKLearnModel):
+    def get_model(self):
+        """
+        Modeling pipeline:
+        1) Features = document-term matrix, with stop words removed from the term vocabulary.
+        2) Classifier (clf) = multinomial Naive Bayes screen, gating a multi-layer
+           perceptron classifier for the sentences that clear ML_CASCADE_GATE
+        """
+        return Pipeline(
+            [
+                (
+                    "features",
+                    CountVectorizer(lowercase=True, stop_words="english", min_df=3),
+                ),
+                (
+                    "clf",
+                    CascadeClassifier(
+                        screen=MultinomialNB(),
+                        model=MLPClassifier(max_iter=1000),
+                        gate=config.ML_CASCADE_GATE / 100,
+                    ),
+                ),
+            ]
+        )
+
+    def get_prediction_settings(self):
+        return super().get_prediction_settings() + [config.ML_CASCADE_GATE]
+
+    def get_mappings_for_sentences(self, sentences, chunk_size=None, on_chunk=None):
+        """Same as SKLearnModel.get_mappings_for_sentences(), logging the routing"""
+        classifier = self.techniques_model.steps[-1][1]
+        classifier.gate = config.ML_CASCADE_GATE / 100
+        classifier.reset_routing_counts()
+
+        all_mappings = super().get_mappings_for_sentences(
+            sentences, chunk_size, on_chunk
+        )
+
+        screened = classifier.n_screened_
+        logger.info(
+            "Cascade scored %d sentences: %0.1f%% by the screen only, "
+            "%0.1f%% routed to the second stage",
+            screened,
+            100 * (screened - classifier.n_routed_) / max(screened, 1),
+            100 * classifier.n_routed_ / max(screened, 1),
+        )
+        return all_mappings
+
+
+class PredictionCache(object):
+    """
+    A database cache of the mappings proposed for sentences, shared by all workers.
+
+    Entries are keyed by a hash of the sentence (with whitespace normalized), the
+    model name and version, and the settings that affect the proposed mappings, so
+    installing a new model version or changing a setting never serves stale
+    mappings. When there are more than max_entries entries, the least recently used
+    ones are evicted.
+    """
+
+    batch_size = IN_QUERY_BATCH_SIZE
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+
+    @staticmethod
+    def get_key_prefix(model):
+        """
+        The part of the keys that is the same for every sentence. Reading the
+        settings can query the database, so this is built once per batch.
+        """
+        parts = [model.__class__.__name__, model.version]
+        parts += [str(value) for value in model.get_prediction_settings()]
+        return "\0".join(parts) + "\0"
+
+    @staticmethod
+    def get_key(key_prefix, sentence):
+        normalized = " ".join(sentence.split())
+        return hashlib.sha256((key_prefix + normalized).encode("utf-8")).hexdigest()
+
+    def get_mappings(self, model, sentences, chunk_size=None, on_chunk=None):
+        """
+        Same as model.get_mappings_for_sentences(), but sentences that are in the
+        cache, or repeated in `sentences`, are only scored once.
+        """
+        key_prefix = self.get_key_prefix(model)
+        keys = [self.get_key(key_prefix, sentence) for sentence in sentences]
+        unique_keys = list(dict.fromkeys(keys))
+        cached = {}
+        for start in range(0, len(unique_keys), self.batch_size):
+            cached.update(
+                db_models.PredictionCacheEntry.objects.filter(
+                    key__in=unique_keys[start : start + self.batch_size]
+                ).values_list("key", "mappings")
+            )
+
+        # Score each sentence that isn't cached once
+        missed = {}  # key -> sentence
+        for key, sentence in zip(keys, sentences):
+            if key not in cached:
+                missed.setdefault(key, sentence)
+        scored = model.get_mappings_for_sentences(
+            list(missed.values()), chunk_size, on_chunk
+        )
+
+        now = datetime.now(timezone.utc)
+        new_entries = []
+        for key, mappings in zip(missed, scored):
+            cached[key] = [[m.attack_id, float(m.confidence)] for m in mappings]
+            new_entries.append(
+                db_models.PredictionCacheEntry(
+                    key=key,
+                    model_name=model.__class__.__name__,
+                    model_version=model.version,
+                    mappings=cached[key],
+                    last_used_on=now,
+                )
+            )
+        db_models.PredictionCacheEntry.objects.bulk_create(
+            new_entries, batch_size=self.batch_size, ignore_conflicts=True
+        )
+        hit_keys = [key for key in unique_keys if key not in missed]
+        for start in range(0, len(hit_keys), self.batch_size):
+            db_models.PredictionCacheEntry.objects.filter(
+                key__in=hit_keys[start : start + self.batch_size]
+            ).update(last_used_on=now)
+        self.evict()
+
+        logger.info(
+            "Prediction cache: scored %d of %d sentences (%0.1f%% hit rate)",
+            len(missed),
+            len(sentences),
+            100 * (len(sentences) - len(missed)) / max(len(sentences), 1),
+        )
+        return [
+            [Mapping(confidence, attack_id) for attack_id, confidence in cached[key]]
+            for key in keys
+        ]
+
+    def evict(self):
+        """Delete the least recently used entries in excess of max_entries"""
+        entries = db_models.PredictionCacheEntry.objects
+        excess = entries.count() - self.max_entries
+        if excess > 0:
+            # Entries used at the same time as the cutoff entry are kept, so the
+            # cache can briefly hold a few more than max_entries entries
+            cutoff = entries.order_by("last_used_on").values_list(
+                "last_used_on", flat=True
+            )[excess]
+            entries.filter(last_used_on__lt=cutoff).delete()
+
+    @staticmethod
+    def purge(model):
+        """Delete the entries of every version of model's class except model's"""
+        db_models.PredictionCacheEntry.objects.filter(
+            model_name=model.__class__.__name__
+        ).exclude(model_version=model.version).delete()
+
+
+class ModelCache(object):
+    """
+    A process-wide cache of models loaded from disk, keyed by model class.
+
+    A cached model is reused for as long as the size and modification time of its
+    file are unchanged. At most max_entries models are kept; the least recently
+    used model is evicted first.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # model class -> ((mtime, size), model)
+        self.load_seconds = {}  # model class -> seconds taken by its last load
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def load(self, model_class, filepath):
+        stat = os.stat(filepath)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(model_class)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(model_class)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        start = time.perf_counter()
+        model = model_class.load_from_file(filepath)
+        elapsed = time.perf_counter() - start
+        logger.info("%s loaded from %s", model_class.__name__, filepath)
+        with self.lock:
+            self.load_seconds[model_class] = elapsed
+            self.entries[model_class] = (signature, model)
+            self.entries.move_to_end(model_class)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return model
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Returns the hit and miss counts and the number of cached models"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+        }
+
+
+def _train_model_worker(model_manager, X, y, warm_start=False):
+    """Trains, evaluates and saves one model for ModelManager.train_models()"""
+    start = time.time()
+    timer = PhaseTimer()
+    previous_model = model_manager.model
+    model_manager.model = copy.deepcopy(previous_model)
+    model_manager.model.train_and_test(
+        X, y, timer=timer, warm_start_from=previous_model if warm_start else None
+    )
+    model_manager.save_model()
+    logger.info("%s training phases: %s", model_manager.model.__class__.__name__, timer)
+    return time.time() - start
+
+
+@contextmanager
+def heartbeat(func, interval):
+    """
+    Calls func every interval seconds from a background thread while the block
+    runs, e.g. to renew a claim during a step that can't report its progress
+    """
+    stopped = threading.Event()
+
+    def run():
+        try:
+            while not stopped.wait(interval):
+                try:
+                    func()
+                except Exception:
+                    logger.exception("Heartbeat failed")
+        finally:
+            connections.close_all()  # The thread's own connections
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def get_worker_id():
+    """Returns an id that is unique to this pipeline worker, across hosts"""
+    return "%s-%d-%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
 class ModelManager(object):
     model_registry = {  # TODO: Add a hook to register user-created models
         "dummy": DummyModel,
         "nb": NaiveBayesModel,
         "logreg": LogisticRegressionModel,
         "nn_cls": MLPClassifierModel,
+        "nb_hash": NaiveBayesHashingModel,
+        "sgd_hash": SGDHashingModel,
+        "cascade": CascadeModel,
     }
+    model_cache = ModelCache(max_entries=settings.ML_MODEL_CACHE_SIZE)
 
     def __init__(self, model):
+        self.recorded_model = None  # The model whose load time is in the metrics
         model_class = self.model_registry.get(model)
         if not model_class:
             raise ValueError("Unrecognized model: %s" % model)
 
         model_filepath = self.get_model_filepath(model_class)
         if path.exists(model_filepath):
-            self.model = model_class.load_from_file(model_filepath)
-            logger.info("%s loaded from %s", model_class.__name__, model_filepath)
+            self.model = self.model_cache.load(model_class, model_filepath)
         else:
             self.model = model_class()
             logger.info("%s loaded from __init__", model_class.__name__)
 
+    def reload_model(self):
+        """
+        Swap in the saved model if its file has changed since it was loaded, e.g.
+        because it was retrained by another process. If the new model can't be
+        loaded, the current model is kept.
+        """
+        model_class = self.model.__class__
+        model_filepath = self.get_model_filepath(model_class)
+        if not path.exists(model_filepath):
+            return
+
+        try:
+            model = self.model_cache.load(model_class, model_filepath)
+        except Exception:
+            logger.exception("Failed to reload %s", model_class.__name__)
+            return
+        logger.debug("Model cache: %s", self.model_cache.stats())
+
+        if model is not self.model:
+            logger.info(
+                "Swapped in %s version %s",
+                model_class.__name__,
+                getattr(model, "version", None),
+            )
+            self.model = model
+            if getattr(model, "version", None):
+                PredictionCache.purge(model)
+
+    def get_model_name(self):
+        """The model name recorded on reports, including the model version if known"""
+        name = self.model.__class__.__name__
+        version = getattr(self.model, "version", None)
+        if version:
+            name = "%s@%s" % (name, version)
+        return name
+
     def _save_report(self, report, document):
         rpt = db_models.Report(
             name=report.name,
             document=document,
             text=report.text,
-            ml_model=self.model.__class__.__name__,
-            created_by=document.created_by,
+            ml_model=self.get_model_name(),
+            created_by_id=document.created_by_id,
         )
         rpt.save()
 
+        # Look up each technique once and insert the mappings together, which keeps
+        # the transaction short when several workers share the database
+        attack_ids = {
+            mapping.attack_id
+            for sentence in report.sentences
+            for mapping in sentence.mappings
+            if mapping.attack_id
+        }
+        attack_objects = db_models.AttackObject.objects.in_bulk(
+            attack_ids, field_name="attack_id"
+        )
+
+        mappings = []
         for sentence in report.sentences:
             s = db_models.Sentence(
                 text=sentence.text,
@@ -375,55 +1353,414 @@ class ModelManager(object):
 
             for mapping in sentence.mappings:
                 if mapping.attack_id:
-                    obj = db_models.AttackObject.objects.get(
-                        attack_id=mapping.attack_id
-                    )
+                    obj = attack_objects.get(mapping.attack_id)
+                    if obj is None:
+                        raise db_models.AttackObject.DoesNotExist(
+                            "Unknown ATT&CK ID: %s" % mapping.attack_id
+                        )
                 else:
                     obj = None
 
-                m = db_models.Mapping(
-                    report=rpt,
-                    sentence=s,
-                    attack_object=obj,
-                    confidence=mapping.confidence,
+                mappings.append(
+                    db_models.Mapping(
+                        report=rpt,
+                        sentence=s,
+                        attack_object=obj,
+                        confidence=mapping.confidence,
+                    )
                 )
-                m.save()
+        db_models.Mapping.objects.bulk_create(mappings)
+
+        return rpt
 
     def run_model(self, run_forever=False):
+        """
+        Process the queued document processing jobs. Each job is claimed before it
+        is started (see claim_job()), so several workers can share the queue.
+
+        With run_forever, waits for a job to be queued when the queue is empty, see
+        tram.ml.wakeup.
+        """
+        worker_id = get_worker_id()
+        listener = wakeup.get_listener() if run_forever else None
+        backoff = wakeup.Backoff(
+            settings.ML_WORKER_POLL_MIN_SECONDS, settings.ML_WORKER_POLL_MAX_SECONDS
+        )
+        try:
+            while True:
+                job = self.claim_job(worker_id)
+                if job is not None:
+                    self.run_job(job, worker_id)
+                    backoff.reset()
+                    continue
+
+                if not run_forever:
+                    return
+                if listener.wait(backoff.next()):
+                    backoff.reset()
+        finally:
+            if listener:
+                listener.close()
+
+    @staticmethod
+    def claim_job(worker_id):
+        """
+        Claim the oldest job that is queued, or whose worker's claim has expired, for
+        ML_WORKER_LEASE_SECONDS. The claim is a conditional update, so a job is only
+        claimed by one worker even if several workers find it at the same time.
+
+        :return: The claimed DocumentProcessingJob, or None if there are no jobs
+        """
         while True:
-            jobs = db_models.DocumentProcessingJob.objects.filter(
-                status="queued"
-            ).order_by("created_on")
-            for job in jobs:
-                filename = job.document.docfile.name
-                logger.info("Processing Job #%d: %s", job.id, filename)
-                try:
-                    report = self.model.process_job(job)
-                    with transaction.atomic():
-                        self._save_report(report, job.document)
-                        job.delete()
-                    logger.info("Created report %s", report.name)
-                except Exception as ex:
-                    job.status = "error"
-                    job.message = str(ex)
-                    job.save()
-                    logger.exception("Failed to create report for %s.", filename)
+            now = datetime.now(timezone.utc)
+            claimable = Q(status="queued") | Q(
+                status="processing", lease_expires_on__lt=now
+            )
+            job = (
+                db_models.DocumentProcessingJob.objects.filter(claimable)
+                .order_by("created_on")
+                .first()
+            )
+            if job is None:
+                return None
+
+            claimed = db_models.DocumentProcessingJob.objects.filter(
+                claimable,
+                id=job.id,
+                status=job.status,
+                lease_expires_on=job.lease_expires_on,
+            ).update(
+                status="processing",
+                worker_id=worker_id,
+                lease_expires_on=now
+                + timedelta(seconds=settings.ML_WORKER_LEASE_SECONDS),
+                updated_on=now,
+            )
+            if claimed:
+                if job.status == "processing":
+                    logger.warning(
+                        "Reclaimed Job #%d from worker %s", job.id, job.worker_id
+                    )
+                job.refresh_from_db()
+                return job
 
-            if not run_forever:
-                return
-            time.sleep(1)
+    def run_job(self, job, worker_id):
+        """
+        Process a DocumentProcessingJob claimed by worker_id. The time spent in each
+        stage, the number of sentences and the size of the document are saved with
+        the report, or with the job if it fails, and added to the pipeline metrics.
+        """
+        # Pick up a retrained model between jobs
+        self.reload_model()
+        if self.model is not self.recorded_model:
+            self.recorded_model = self.model
+            self._record_model_load()
+
+        claim = db_models.DocumentProcessingJob.objects.filter(
+            id=job.id, worker_id=worker_id
+        )
+
+        def on_phase(name):
+            # Renew the claim as each stage starts, and as classifying makes progress
+            claim.update(
+                lease_expires_on=datetime.now(timezone.utc)
+                + timedelta(seconds=settings.ML_WORKER_LEASE_SECONDS)
+            )
 
-    def get_model_filepath(self, model_class):
+        filename = job.document.docfile.name
+        logger.info("Processing Job #%d: %s", job.id, filename)
+        timer = PhaseTimer(on_phase=on_phase)
+        try:
+            timer.counters["document_bytes"] = job.document.docfile.size
+            report = self.model.process_job(job, timer=timer)
+            with timer.phase("save"):
+                with transaction.atomic():
+                    rpt = self._save_report(report, job.document)
+                    deleted, _ = claim.delete()
+                    if not deleted:
+                        raise ClaimLostError()
+        except ClaimLostError:
+            logger.warning(
+                "Job #%d was reclaimed by another worker, discarded its report", job.id
+            )
+            return
+        except Exception as ex:
+            timings = timer.as_dict()
+            claim.update(
+                status="error",
+                message=str(ex),
+                timings=timings,
+                lease_expires_on=None,
+                updated_on=datetime.now(timezone.utc),
+            )
+            logger.exception("Failed to create report for %s.", filename)
+            self._record_job(timings, succeeded=False)
+            return
+
+        logger.info("Created report %s: %s", report.name, timer)
+        self._record_job(timer.as_dict(), succeeded=True, rpt=rpt)
+
+    def _record_job(self, timings, succeeded, rpt=None):
+        # The job is finished, so failing to record it must not fail the job or stop
+        # the worker
+        try:
+            if rpt is not None:
+                rpt.timings = timings
+                rpt.save(update_fields=["timings"])
+            metrics.record_job(timings, succeeded)
+        except Exception:
+            logger.exception("Failed to record the metrics of a processed job.")
+
+    def _record_model_load(self):
+        model_class = self.model.__class__
+        seconds = self.model_cache.load_seconds.get(model_class)
+        if seconds is None:
+            return
+        try:
+            metrics.record_model_load(model_class.__name__, seconds)
+        except Exception:
+            logger.exception(
+                "Failed to record the load time of %s.", model_class.__name__
+            )
+
+    @staticmethod
+    def get_metadata_filepath(model_class):
+        return os.path.join(settings.ML_MODEL_DIR, model_class.__name__ + ".json")
+
+    @classmethod
+    def load_model_metadata(cls, model_class):
+        """
+        Returns the metadata saved with a model (see SKLearnModel.get_metadata()).
+        Only models saved before metadata files were introduced need to be loaded.
+        """
+        metadata_filepath = cls.get_metadata_filepath(model_class)
+        if path.exists(metadata_filepath):
+            with open(metadata_filepath, "r") as f:
+                return json.load(f)
+
+        model_filepath = cls.get_model_filepath(model_class)
+        if path.exists(model_filepath):
+            return cls.model_cache.load(model_class, model_filepath).get_metadata()
+        return model_class().get_metadata()
+
+    @staticmethod
+    def get_model_filepath(model_class):
         filepath = settings.ML_MODEL_DIR + "/" + model_class.__name__ + ".pkl"
         return filepath
 
-    def train_model(self):
-        self.model.train()
-        self.model.test()
+    def train_model(
+        self, rebuild_cache=False, incremental=False, timer=None, warm_start=None
+    ):
+        """
+        Train, evaluate and save the model.
+
+        If incremental is True and the model supports it, the trained model is only
+        updated with the mappings created since it was last trained. Otherwise the
+        model is trained on the whole corpus: from scratch, or if warm_start
+        (default: ML_WARM_START) is True, starting from the current model's weights
+        where the model supports it.
+
+        :param timer: An optional PhaseTimer that records the training phases
+        """
+        if rebuild_cache:
+            logger.info("Rebuilding the preprocessed corpus cache")
+            preprocessing.get_corpus_cache().clear()
+
+        if incremental and not self.model.supports_incremental_training():
+            logger.warning(
+                "%s does not support incremental training; training from scratch",
+                self.model.__class__.__name__,
+            )
+            incremental = False
+        elif incremental and self.model.last_trained is None:
+            logger.warning("Model has never been trained; training from scratch")
+            incremental = False
+
+        if warm_start is None:
+            warm_start = settings.ML_WARM_START
+
+        # The loaded model may be shared through the model cache, so train a copy
+        previous_model = self.model
+        self.model = copy.deepcopy(self.model)
+
+        timer = timer or PhaseTimer()
+        if incremental:
+            with timer.phase("train incremental"):
+                self.model.train_incremental()
+        else:
+            self.model.train_and_test(
+                timer=timer, warm_start_from=previous_model if warm_start else None
+            )
+        with timer.phase("save"):
+            self.save_model()
+        logger.info("Training phases: %s", timer)
+
+    def save_model(self):
+        """Save the model, plus its metadata to a JSON file next to it"""
         filepath = self.get_model_filepath(self.model.__class__)
         self.model.save_to_file(filepath)
         logger.info("Trained model saved to %s" % filepath)
 
+        metadata_filepath = self.get_metadata_filepath(self.model.__class__)
+        with artifacts.atomic_open(metadata_filepath, "w") as f:
+            json.dump(self.model.get_metadata(), f)
+
+    @classmethod
+    def run_training_jobs(cls, run_forever=False):
+        """
+        Process queued training jobs (see tram.models.TrainingJob), oldest first.
+        Each job is claimed before it is started, so several trainer processes can
+        share the queue.
+        """
+        worker_id = get_worker_id()
+        while True:
+            job = cls.claim_training_job(worker_id)
+            if job is not None:
+                cls.run_training_job(job, worker_id)
+                continue
+
+            if not run_forever:
+                return
+            time.sleep(1)
+
+    @staticmethod
+    def claim_training_job(worker_id):
+        """
+        Claim the oldest training job that is queued, or whose trainer's claim has
+        expired, for ML_TRAINING_LEASE_SECONDS. As for claim_job(), the claim is a
+        conditional update.
+
+        :return: The claimed TrainingJob, or None if there are no jobs
+        """
+        while True:
+            now = datetime.now(timezone.utc)
+            claimable = Q(status="queued") | Q(
+                status="training", lease_expires_on__lt=now
+            )
+            job = (
+                db_models.TrainingJob.objects.filter(claimable)
+                .order_by("created_on")
+                .first()
+            )
+            if job is None:
+                return None
+
+            claimed = db_models.TrainingJob.objects.filter(
+                claimable,
+                id=job.id,
+                status=job.status,
+                lease_expires_on=job.lease_expires_on,
+            ).update(
+                status="training",
+                worker_id=worker_id,
+                lease_expires_on=now
+                + timedelta(seconds=settings.ML_TRAINING_LEASE_SECONDS),
+                started_on=now,
+                updated_on=now,
+            )
+            if claimed:
+                if job.status == "training":
+                    logger.warning(
+                        "Reclaimed Training Job #%d from trainer %s",
+                        job.id,
+                        job.worker_id,
+                    )
+                job.refresh_from_db()
+                return job
+
+    @classmethod
+    def run_training_job(cls, job, worker_id):
+        """
+        Train the model for a TrainingJob claimed by worker_id, recording its progress
+        on the job
+        """
+        claim = db_models.TrainingJob.objects.filter(id=job.id, worker_id=worker_id)
+        lease_seconds = settings.ML_TRAINING_LEASE_SECONDS
+
+        def renew_lease(**fields):
+            now = datetime.now(timezone.utc)
+            claim.update(
+                lease_expires_on=now + timedelta(seconds=lease_seconds),
+                updated_on=now,
+                **fields,
+            )
+
+        def on_phase(name):
+            # Record progress and renew the claim as each stage starts
+            renew_lease(phase=name)
+
+        logger.info("Processing Training Job #%d: %s", job.id, job.model_key)
+        try:
+            model_manager = cls(job.model_key)
+            timer = PhaseTimer(on_phase=on_phase)
+            # A stage such as fit is a single call that can outlast the lease, so the
+            # claim is also renewed in the background while the model trains
+            with heartbeat(renew_lease, lease_seconds / 3):
+                model_manager.train_model(incremental=job.incremental, timer=timer)
+            metadata = model_manager.model.get_metadata()
+            result = {
+                "status": "done",
+                "metrics": {
+                    "version": metadata["version"],
+                    "average_f1_score": metadata["average_f1_score"],
+                    "timings": timer.timings,
+                },
+            }
+            logger.info("Trained %s", job.model_key)
+        except Exception as ex:
+            result = {"status": "error", "message": str(ex)}
+            logger.exception("Failed to train %s.", job.model_key)
+
+        now = datetime.now(timezone.utc)
+        finished = claim.update(
+            phase="", lease_expires_on=None, finished_on=now, updated_on=now, **result
+        )
+        if not finished:
+            logger.warning("Training Job #%d was reclaimed by another trainer", job.id)
+
+    @classmethod
+    def train_models(cls, model_keys, workers=None, warm_start=None):
+        """
+        Train, evaluate and save several models concurrently.
+
+        The training data is loaded and preprocessed once in this process, then each
+        model is trained in its own worker process and saved to its own file.
+
+        :param model_keys: A list of keys from model_registry
+        :param workers: Number of worker processes. Defaults to one per model.
+        :param warm_start: As for train_model(). Default: ML_WARM_START
+        :return: A dict of model key -> seconds spent training that model
+        """
+        if warm_start is None:
+            warm_start = settings.ML_WARM_START
+
+        model_managers = {model_key: cls(model_key) for model_key in model_keys}
+
+        timer = PhaseTimer()
+        X, y = model_managers[model_keys[0]].model.get_training_data(timer=timer)
+        logger.info("Prepared training data for %d models: %s", len(model_keys), timer)
+
+        # Workers can read settings from the database (e.g. ML_CASCADE_GATE), so they
+        # must open their own connections rather than share this process's
+        connections.close_all()
+        # django.setup() lets workers unpickle the models if processes are spawned
+        with ProcessPoolExecutor(
+            max_workers=workers or len(model_keys), initializer=django.setup
+        ) as executor:
+            futures = {
+                model_key: executor.submit(
+                    _train_model_worker, model_manager, X, y, warm_start
+                )
+                for model_key, model_manager in model_managers.items()
+            }
+            elapsed = {
+                model_key: future.result() for model_key, future in futures.items()
+            }
+
+        for model_key in model_keys:
+            logger.info("%s trained in %0.3f seconds", model_key, elapsed[model_key])
+        return elapsed
+
     @staticmethod
     def get_all_model_metadata():
         """
@@ -445,27 +1782,36 @@ class ModelManager(object):
         """
         Returns a dict of model metadata for a particular ML model, identified by it's key
         """
-        mm = ModelManager(model_key)
-        model_name = mm.model.__class__.__name__
-        if mm.model.last_trained is None:
+        model_class = ModelManager.model_registry.get(model_key)
+        if not model_class:
+            raise ValueError("Unrecognized model: %s" % model_key)
+
+        metadata = ModelManager.load_model_metadata(model_class)
+        model_name = model_class.__name__
+        stored_scores = metadata["detailed_f1_score"] or []
+        if metadata["last_trained"] is None:
             last_trained = "Never trained"
             trained_techniques_count = 0
         else:
-            last_trained = mm.model.last_trained.strftime("%m/%d/%Y %H:%M:%S UTC")
-            trained_techniques_count = len(mm.model.detailed_f1_score)
+            last_trained = datetime.fromisoformat(metadata["last_trained"]).strftime(
+                "%m/%d/%Y %H:%M:%S UTC"
+            )
+            trained_techniques_count = len(stored_scores)
 
-        average_f1_score = round((mm.model.average_f1_score or 0.0) * 100, 2)
-        stored_scores = mm.model.detailed_f1_score or []
+        average_f1_score = round((metadata["average_f1_score"] or 0.0) * 100, 2)
         attack_ids = set([score[0] for score in stored_scores])
-        attack_techniques = db_models.AttackObject.objects.filter(
-            attack_id__in=attack_ids
-        )
+        attack_techniques = {
+            attack_technique.attack_id: attack_technique
+            for attack_technique in db_models.AttackObject.objects.filter(
+                attack_id__in=attack_ids
+            )
+        }
         detailed_f1_score = []
         for score in stored_scores:
             score_id = score[0]
             score_value = round(score[1] * 100, 2)
 
-            attack_technique = attack_techniques.get(attack_id=score_id)
+            attack_technique = attack_techniques[score_id]
             detailed_f1_score.append(
                 {
                     "technique": score_id,
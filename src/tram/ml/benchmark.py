@@ -0,0 +1,301 @@
+"""
+Throughput benchmarks for the document processing pipeline.
+
+Synthetic threat reports of a configurable size are generated in each supported
+format. For each trained model, each stage of processing a report is timed: text
+extraction, sentence tokenization, classification and saving the report to the
+database. Results are written as JSON so that runs can be compared, and stages
+that are slower than in a baseline run are flagged as regressions.
+"""
+import logging
+import platform
+import random
+import textwrap
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+import docx
+import sklearn
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from tram import models as db_models
+from tram.ml import base
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ["pdf", "docx", "html", "txt"]
+STAGES = ["extract", "tokenize", "classify", "save"]
+
+ACTORS = [
+    "The threat actor",
+    "The group",
+    "The operators",
+    "APT29",
+    "FIN7",
+    "Lazarus Group",
+    "The attackers",
+]
+BEHAVIORS = [
+    "used PowerShell to execute a malicious script",
+    "sent spearphishing emails with malicious attachments",
+    "dumped credentials from LSASS memory",
+    "established persistence through a registry run key",
+    "exfiltrated data over an encrypted command and control channel",
+    "used scheduled tasks to execute the payload",
+    "encrypted files on network shares",
+    "deleted volume shadow copies to inhibit recovery",
+    "moved laterally using Remote Desktop Protocol",
+    "obfuscated the payload with Base64 encoding",
+    "harvested browser cookies and saved passwords",
+    "scanned the internal network for open SMB ports",
+]
+CONTEXTS = [
+    "after gaining initial access",
+    "on the compromised host",
+    "to evade detection",
+    "during the intrusion",
+    "within hours of the initial compromise",
+]
+BOILERPLATE = [
+    "This report is provided for informational purposes only.",
+    "TLP:WHITE - Disclosure is not limited.",
+    "The indicators of compromise are listed in the appendix.",
+    "Organizations are advised to review their logs for this activity.",
+    "The sample was first observed on {date}.",
+    "The file with SHA256 hash {hash} communicated with {ip}.",
+]
+
+
+def generate_sentences(n_sentences, seed=0):
+    """Returns a list of n_sentences synthetic threat report sentences"""
+    rng = random.Random(seed)
+    sentences = []
+    for _ in range(n_sentences):
+        if rng.random() < 0.5:
+            sentence = "%s %s" % (rng.choice(ACTORS), rng.choice(BEHAVIORS))
+            if rng.random() < 0.5:
+                sentence += " " + rng.choice(CONTEXTS)
+            sentence += "."
+        else:
+            sentence = rng.choice(BOILERPLATE).format(
+                date="2021-%02d-%02d" % (rng.randint(1, 12), rng.randint(1, 28)),
+                hash="%064x" % rng.getrandbits(256),
+                ip="203.0.113.%d" % rng.randint(1, 254),
+            )
+        sentences.append(sentence)
+    return sentences
+
+
+def write_txt(sentences):
+    return "\n".join(sentences).encode("utf-8")
+
+
+def write_html(sentences):
+    paragraphs = "\n".join("<p>%s</p>" % sentence for sentence in sentences)
+    return (
+        "<html><head><title>Threat Report</title></head><body>%s</body></html>"
+        % paragraphs
+    ).encode("utf-8")
+
+
+def write_docx(sentences):
+    document = docx.Document()
+    for sentence in sentences:
+        document.add_paragraph(sentence)
+    f = BytesIO()
+    document.save(f)
+    return f.getvalue()
+
+
+def write_pdf(sentences, line_length=90, lines_per_page=50):
+    """Returns a minimal PDF with the sentences as text, wrapped onto pages"""
+    lines = textwrap.wrap(" ".join(sentences), line_length)
+    pages = [
+        lines[start : start + lines_per_page]
+        for start in range(0, len(lines), lines_per_page)
+    ] or [[]]
+
+    # Objects 1-3 are the catalog, the page tree and the font, then each page is
+    # followed by its content stream
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>"
+        % (b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(pages)),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for page_id, page in zip(page_ids, pages):
+        text = b"".join(
+            b"(%s) Tj T* "
+            % line.replace("\\", "\\\\")
+            .replace("(", "\\(")
+            .replace(")", "\\)")
+            .encode("latin-1", "replace")
+            for line in page
+        )
+        stream = b"BT /F1 10 Tf 14 TL 50 750 Td " + text + b"ET"
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % (page_id + 1)
+        )
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    return pdf
+
+
+WRITERS = {
+    "pdf": write_pdf,
+    "docx": write_docx,
+    "html": write_html,
+    "txt": write_txt,
+}
+
+
+def time_stages(model_manager, document, repeat=3):
+    """
+    Process document with model_manager's model repeat times. Returns the number of
+    sentences in the document and the fastest time of each stage in seconds.
+
+    Classification calls the model directly, so the prediction cache isn't used.
+    """
+    model = model_manager.model
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with document.docfile.open("rb"):
+            text = model._extract_text(document)
+        timings["extract"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        sentences = model._sentence_tokenize(text)
+        timings["tokenize"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        all_mappings = model.get_mappings_for_sentences(
+            sentences, settings.ML_INFERENCE_CHUNK_SIZE
+        )
+        timings["classify"].append(time.perf_counter() - start)
+
+        report = base.Report(
+            "Benchmark report",
+            text,
+            [
+                base.Sentence(text=sentence, order=order, mappings=mappings)
+                for order, (sentence, mappings) in enumerate(
+                    zip(sentences, all_mappings)
+                )
+            ],
+        )
+        start = time.perf_counter()
+        with transaction.atomic():
+            model_manager._save_report(report, document)
+        timings["save"].append(time.perf_counter() - start)
+
+    return len(sentences), {stage: min(seconds) for stage, seconds in timings.items()}
+
+
+def run(model_keys, n_sentences=200, formats=None, repeat=3, seed=0):
+    """
+    Benchmark each model in model_keys on a synthetic report in each format.
+    Untrained models are skipped. The documents and reports that are created are
+    deleted afterwards.
+
+    :return: A JSON-serializable dict of the parameters and results of the run
+    """
+    formats = formats or FORMATS
+    sentences = generate_sentences(n_sentences, seed=seed)
+    documents = {}
+    for fmt in formats:
+        document = db_models.Document(
+            docfile=ContentFile(WRITERS[fmt](sentences), name="benchmark.%s" % fmt)
+        )
+        document.save()
+        documents[fmt] = document
+
+    results = {}
+    try:
+        for model_key in model_keys:
+            model_manager = base.ModelManager(model_key)
+            if model_manager.model.last_trained is None:
+                logger.warning("Skipping %s, which has not been trained", model_key)
+                continue
+
+            results[model_key] = {}
+            for fmt, document in documents.items():
+                n_extracted, seconds = time_stages(model_manager, document, repeat)
+                results[model_key][fmt] = {"sentences": n_extracted, "seconds": seconds}
+                logger.info(
+                    "%-10s %-5s %s",
+                    model_key,
+                    fmt,
+                    ", ".join("%s=%0.4fs" % item for item in seconds.items()),
+                )
+    finally:
+        # Also deletes the benchmark reports
+        for document in documents.values():
+            document.delete()
+
+    return {
+        "created_on": datetime.now(timezone.utc).isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "sklearn": sklearn.__version__,
+        "parameters": {
+            "sentences": n_sentences,
+            "formats": formats,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def find_regressions(run_results, baseline, tolerance=0.2, min_seconds=0.001):
+    """
+    Compares two results of run(). Returns a list of the stages that took more than
+    (1 + tolerance) times as long as in baseline, ignoring slowdowns of less than
+    min_seconds.
+    """
+    regressions = []
+    for model_key, model_results in run_results["results"].items():
+        for fmt, result in model_results.items():
+            baseline_result = baseline["results"].get(model_key, {}).get(fmt)
+            if baseline_result is None:
+                continue
+
+            for stage, seconds in result["seconds"].items():
+                baseline_seconds = baseline_result["seconds"].get(stage)
+                if baseline_seconds is None:
+                    continue
+                if (
+                    seconds > baseline_seconds * (1 + tolerance)
+                    and seconds - baseline_seconds > min_seconds
+                ):
+                    regressions.append(
+                        {
+                            "model": model_key,
+                            "format": fmt,
+                            "stage": stage,
+                            "baseline_seconds": baseline_seconds,
+                            "seconds": seconds,
+                        }
+                    )
+    return regressions
@@ -0,0 +1,225 @@
+"""
+Prometheus metrics for the document processing pipeline.
+
+Workers add the outcome of each processed job to a small, fixed set of
+PipelineMetric rows (counters and histogram buckets), which are updated in place.
+A scrape reads those rows plus the queue depth and the age of the oldest queued
+job, which are served by the (status, created_on) index on DocumentProcessingJob,
+so its cost doesn't grow with the number of reports, sentences or mappings.
+
+Metrics are rendered in the Prometheus text exposition format.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.db import transaction
+from django.db.models import Count, F, Min
+
+from tram import models as db_models
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+JOB_SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SAVE_SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name -> help
+COUNTERS = {
+    "tram_jobs_processed_total": "Document processing jobs finished, by result.",
+    "tram_sentences_classified_total": "Sentences classified by the pipeline.",
+    "tram_classify_seconds_total": "Time spent classifying sentences.",
+}
+GAUGES = {
+    "tram_classify_sentences_per_second": "Classification throughput of the most recently processed document.",
+    "tram_model_load_seconds": "Time taken to load each model the last time a pipeline worker loaded it.",
+}
+# name -> (help, buckets)
+HISTOGRAMS = {
+    "tram_job_processing_seconds": (
+        "Time taken to process a document, from text extraction to saving the report.",
+        JOB_SECONDS_BUCKETS,
+    ),
+    "tram_report_save_seconds": (
+        "Time taken to save a report to the database.",
+        SAVE_SECONDS_BUCKETS,
+    ),
+}
+
+
+def series_key(name, **labels):
+    """Returns the key of a series, e.g. tram_jobs_processed_total{result="error"}"""
+    if not labels:
+        return name
+    return "%s{%s}" % (
+        name,
+        ",".join('%s="%s"' % (label, value) for label, value in sorted(labels.items())),
+    )
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def add(amounts):
+    """
+    Add to counter series.
+
+    :param amounts: A dict of series key -> amount to add
+    """
+    db_models.PipelineMetric.objects.bulk_create(
+        [db_models.PipelineMetric(key=key) for key in amounts],
+        ignore_conflicts=True,
+    )
+
+    # One UPDATE per distinct amount, e.g. all of the histogram buckets a value falls in
+    keys_by_amount = defaultdict(list)
+    for key, amount in amounts.items():
+        keys_by_amount[amount].append(key)
+    for amount, keys in keys_by_amount.items():
+        db_models.PipelineMetric.objects.filter(key__in=keys).update(
+            value=F("value") + amount
+        )
+
+
+def histogram_amounts(name, value):
+    """Returns the counter amounts that record value in the histogram name"""
+    buckets = HISTOGRAMS[name][1]
+    amounts = {
+        series_key(name + "_bucket", le=_format_value(bucket)): 1
+        for bucket in buckets + (float("inf"),)
+        if value <= bucket
+    }
+    amounts[name + "_count"] = 1
+    amounts[name + "_sum"] = value
+    return amounts
+
+
+def set_gauge(key, value):
+    # Writes without reading first: on SQLite, two workers that both read and then
+    # write in a transaction can't wait for each other and one fails immediately
+    db_models.PipelineMetric.objects.bulk_create(
+        [db_models.PipelineMetric(key=key)], ignore_conflicts=True
+    )
+    db_models.PipelineMetric.objects.filter(key=key).update(value=value)
+
+
+def record_job(timings, succeeded):
+    """
+    Record a finished document processing job.
+
+    :param timings: The job's timings, see tram.ml.base.PhaseTimer.as_dict()
+    :param succeeded: Whether a report was created
+    """
+    amounts = {
+        series_key(
+            "tram_jobs_processed_total", result="success" if succeeded else "error"
+        ): 1
+    }
+    throughput = None
+    if succeeded:
+        seconds = timings["seconds"]
+        amounts.update(
+            histogram_amounts("tram_job_processing_seconds", timings["total_seconds"])
+        )
+        if "save" in seconds:
+            amounts.update(
+                histogram_amounts("tram_report_save_seconds", seconds["save"])
+            )
+        if "classify" in seconds:
+            sentences = timings.get("sentences", 0)
+            amounts["tram_sentences_classified_total"] = sentences
+            amounts["tram_classify_seconds_total"] = seconds["classify"]
+            if seconds["classify"] > 0:
+                throughput = sentences / seconds["classify"]
+
+    with transaction.atomic():
+        add(amounts)
+        if throughput is not None:
+            set_gauge("tram_classify_sentences_per_second", throughput)
+
+
+def record_model_load(model_name, seconds):
+    set_gauge(series_key("tram_model_load_seconds", model=model_name), seconds)
+
+
+def _family_lines(name, metric_type, help_text, values, default_keys=()):
+    lines = ["# HELP %s %s" % (name, help_text), "# TYPE %s %s" % (name, metric_type)]
+    prefixes = (name + "{", name + "_bucket{")
+    keys = set(default_keys)
+    keys.update(
+        key
+        for key in values
+        if key.startswith(prefixes) or key in (name, name + "_sum", name + "_count")
+    )
+    for key in sorted(keys, key=_sort_key):
+        lines.append("%s %s" % (key, _format_value(values.get(key, 0.0))))
+    return lines
+
+
+def _sort_key(key):
+    # Orders histogram buckets by their upper bound rather than alphabetically
+    if '_bucket{le="' in key:
+        bound = key.split('le="', 1)[1].rstrip('"}')
+        return (0, float("inf") if bound == "+Inf" else float(bound))
+    return (1, key)
+
+
+def render():
+    """Returns all of the metrics in the Prometheus text exposition format"""
+    values = dict(db_models.PipelineMetric.objects.values_list("key", "value"))
+
+    # Series that are rendered as 0 before anything has been recorded
+    default_keys = {
+        "tram_jobs_processed_total": [
+            series_key("tram_jobs_processed_total", result=result)
+            for result in ("success", "error")
+        ],
+        "tram_sentences_classified_total": ["tram_sentences_classified_total"],
+        "tram_classify_seconds_total": ["tram_classify_seconds_total"],
+    }
+
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += _family_lines(
+            name, "counter", help_text, values, default_keys.get(name, ())
+        )
+    for name, help_text in GAUGES.items():
+        lines += _family_lines(name, "gauge", help_text, values)
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        bucket_keys = [
+            series_key(name + "_bucket", le=_format_value(bucket))
+            for bucket in buckets + (float("inf"),)
+        ]
+        lines += _family_lines(
+            name,
+            "histogram",
+            help_text,
+            values,
+            bucket_keys + [name + "_sum", name + "_count"],
+        )
+
+    job_counts = {status: 0 for status, _ in db_models.JOB_STATUS_CHOICES}
+    job_counts.update(
+        db_models.DocumentProcessingJob.objects.values_list("status")
+        .annotate(Count("id"))
+        .order_by()
+    )
+    lines += _family_lines(
+        "tram_jobs",
+        "gauge",
+        "Document processing jobs, by status.",
+        {series_key("tram_jobs", status=status): n for status, n in job_counts.items()},
+    )
+
+    oldest = db_models.DocumentProcessingJob.objects.filter(status="queued").aggregate(
+        Min("created_on")
+    )["created_on__min"]
+    age = (datetime.now(timezone.utc) - oldest).total_seconds() if oldest else 0.0
+    lines += _family_lines(
+        "tram_oldest_queued_job_age_seconds",
+        "gauge",
+        "Time since the oldest queued document processing job was created.",
+        {"tram_oldest_queued_job_age_seconds": age},
+    )
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,192 @@
+import functools
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import nltk
+from django.conf import settings
+
+from tram.ml import artifacts
+
+logger = logging.getLogger(__name__)
+
+
+class Lemmatizer(object):
+    """
+    A WordNet lemmatizer with a bounded, token-level LRU cache.
+
+    Training corpora and threat reports have a small vocabulary compared to their
+    number of tokens, so most WordNet lookups can be served from the cache.
+    """
+
+    def __init__(self, cache_size=None):
+        self._lemmatizer = nltk.stem.WordNetLemmatizer()
+        self.lemmatize_word = functools.lru_cache(maxsize=cache_size)(
+            self._lemmatizer.lemmatize
+        )
+
+    def lemmatize(self, sentence):
+        """
+        Preprocess text by
+        1) Lemmatizing - reducing words to their root, as a way to eliminate noise in the text
+        2) Removing digits
+        """
+        # Lemmatize each word in sentence
+        lemmatized_sentence = " ".join(
+            [self.lemmatize_word(w) for w in sentence.rstrip().split()]
+        )
+        lemmatized_sentence = re.sub(
+            r"\d+", "", lemmatized_sentence
+        )  # Remove digits with regex
+
+        return lemmatized_sentence
+
+    def lemmatize_sentences(self, sentences):
+        """Preprocess a list of sentences. Returns the lemmatized sentences in the same order."""
+        return [self.lemmatize(sentence) for sentence in sentences]
+
+    def cache_info(self):
+        """Returns the hits, misses, maxsize and currsize of the token cache"""
+        return self.lemmatize_word.cache_info()
+
+    def clear_cache(self):
+        self.lemmatize_word.cache_clear()
+
+
+_lemmatizer = None
+
+
+def get_lemmatizer():
+    """Returns the process-wide Lemmatizer, creating it on first use"""
+    global _lemmatizer
+    if _lemmatizer is None:
+        _lemmatizer = Lemmatizer(cache_size=settings.ML_LEMMATIZER_CACHE_SIZE)
+    return _lemmatizer
+
+
+def _lemmatize_chunk(sentences):
+    return get_lemmatizer().lemmatize_sentences(sentences)
+
+
+def lemmatize_sentences(sentences, workers=1, chunk_size=None):
+    """
+    Preprocess a list of sentences, optionally spread over a pool of worker processes.
+
+    With `workers` > 1 the sentences are split into chunks of `chunk_size` that are
+    lemmatized in parallel. Results are always returned in the order of `sentences`,
+    so the output is identical to the serial path.
+    """
+    if not chunk_size:
+        chunk_size = max(len(sentences), 1)
+
+    if workers <= 1 or len(sentences) <= chunk_size:
+        return get_lemmatizer().lemmatize_sentences(sentences)
+
+    chunks = [
+        sentences[start : start + chunk_size]
+        for start in range(0, len(sentences), chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map() yields results in the order that chunks were submitted
+        lemmatized_chunks = executor.map(_lemmatize_chunk, chunks)
+        return [sentence for chunk in lemmatized_chunks for sentence in chunk]
+
+
+class CorpusCache(object):
+    """
+    A persistent cache of preprocessed training sentences.
+
+    Entries are keyed by sentence id and are reused for as long as the sentence's
+    updated_on timestamp doesn't change, so retraining only needs to preprocess
+    sentences that are new or have changed since the last training run.
+    """
+
+    # Bump this when the preprocessing changes so that stale entries are discarded
+    format_version = 1
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.entries = {}  # sentence id -> (updated_on, lemmatized text)
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filepath, "r") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if cache.get("format_version") != self.format_version:
+            logger.info("Discarding corpus cache with a different format version")
+            return
+
+        self.entries = {
+            int(sentence_id): tuple(entry)
+            for sentence_id, entry in cache["entries"].items()
+        }
+
+    def save(self):
+        cache = {"format_version": self.format_version, "entries": self.entries}
+        # Readers never see a partial file, even if several processes save at once
+        with artifacts.atomic_open(self.filepath, "w") as f:
+            json.dump(cache, f)
+
+    def clear(self):
+        self.entries = {}
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+    def get_stale_ids(self, updated_on):
+        """
+        Returns the ids of the sentences that are missing from the cache or have
+        changed, given a dict of sentence id -> updated_on
+        """
+        return [
+            sentence_id
+            for sentence_id, sentence_updated_on in updated_on.items()
+            if self.entries.get(sentence_id, (None,))[0] != sentence_updated_on
+        ]
+
+    def preprocess(self, sentences, workers=1, chunk_size=None, prune=True):
+        """
+        Returns a dict mapping each sentence id to its lemmatized text.
+
+        :param sentences: A dict of sentence id -> (updated_on, text). Only sentences
+                          that are missing from the cache or have a different
+                          updated_on are lemmatized; the text of the other
+                          sentences isn't used and may be None.
+        :param prune: True if `sentences` is the whole corpus, in which case cached
+                      sentences that are no longer in it are dropped.
+        """
+        stale_ids = self.get_stale_ids(
+            {
+                sentence_id: updated_on
+                for sentence_id, (updated_on, _) in sentences.items()
+            }
+        )
+        lemmatized = lemmatize_sentences(
+            [sentences[sentence_id][1] for sentence_id in stale_ids],
+            workers=workers,
+            chunk_size=chunk_size,
+        )
+        for sentence_id, lemmatized_sentence in zip(stale_ids, lemmatized):
+            self.entries[sentence_id] = (sentences[sentence_id][0], lemmatized_sentence)
+
+        deleted_ids = set(self.entries) - set(sentences) if prune else set()
+        for sentence_id in deleted_ids:
+            del self.entries[sentence_id]
+
+        logger.info(
+            "Corpus cache: reused %d, preprocessed %d, dropped %d sentences",
+            len(sentences) - len(stale_ids),
+            len(stale_ids),
+            len(deleted_ids),
+        )
+        return {sentence_id: self.entries[sentence_id][1] for sentence_id in sentences}
+
+
+def get_corpus_cache():
+    """Returns the CorpusCache stored in ML_MODEL_DIR"""
+    return CorpusCache(os.path.join(settings.ML_MODEL_DIR, "corpus-cache.json"))
@@ -0,0 +1,175 @@
+"""
+Wakes up pipeline workers as soon as a document processing job is queued.
+
+Workers wait for a notification rather than polling the job queue every second:
+- On PostgreSQL, with LISTEN/NOTIFY on the tram_jobs channel.
+- On other databases, which are assumed to be on the worker's host (SQLite), each
+  worker binds a Unix datagram socket in ML_WORKER_SOCKET_DIR and a notification
+  is a datagram sent to every socket in the directory.
+- Otherwise, e.g. when Unix sockets aren't available, workers only poll.
+
+Notifications are a latency optimization only. Workers still poll the queue with
+an interval that backs off while the queue is empty, so a missed notification
+delays a job but never loses it.
+"""
+import logging
+import os
+import select
+import socket
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class Backoff(object):
+    """Poll intervals that double from min_seconds up to max_seconds"""
+
+    def __init__(self, min_seconds, max_seconds):
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.seconds = min_seconds
+
+    def next(self):
+        seconds = self.seconds
+        self.seconds = min(self.seconds * 2, self.max_seconds)
+        return seconds
+
+    def reset(self):
+        self.seconds = self.min_seconds
+
+
+class PollingListener(object):
+    def wait(self, timeout):
+        """Wait for a notification for up to timeout seconds. Returns True if notified."""
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+class PostgresListener(object):
+    def __init__(self):
+        self.connection = None
+        self.connect()
+
+    def connect(self):
+        # A connection of its own, so that notifications are read as they arrive
+        # and LISTEN isn't affected by the transactions of the worker's connection
+        self.connection = connection.get_new_connection(
+            connection.get_connection_params()
+        )
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            cursor.execute("LISTEN tram_jobs")
+
+    def wait(self, timeout):
+        try:
+            if self.connection is None:
+                self.connect()
+            readable, _, _ = select.select([self.connection], [], [], timeout)
+            if not readable:
+                return False
+            self.connection.poll()
+        except Exception:
+            logger.warning("Lost the job notification connection", exc_info=True)
+            self.close()
+            time.sleep(timeout)
+            return False
+
+        notified = bool(self.connection.notifies)
+        self.connection.notifies.clear()
+        return notified
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class SocketListener(object):
+    def __init__(self, socket_dir):
+        os.makedirs(socket_dir, exist_ok=True)
+        self.path = os.path.join(socket_dir, "%s.sock" % uuid.uuid4().hex[:12])
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.socket.bind(self.path)
+        except OSError:
+            self.socket.close()
+            raise
+        self.socket.setblocking(False)
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.socket], [], [], timeout)
+        if not readable:
+            return False
+        # Several notifications are handled by one pass over the queue
+        try:
+            while True:
+                self.socket.recv(16)
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        self.socket.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def get_listener():
+    """Returns a listener for job notifications that suits the database"""
+    try:
+        if connection.vendor == "postgresql":
+            return PostgresListener()
+        if hasattr(socket, "AF_UNIX"):
+            return SocketListener(settings.ML_WORKER_SOCKET_DIR)
+    except Exception:
+        logger.warning(
+            "Can't listen for job notifications, polling instead", exc_info=True
+        )
+    return PollingListener()
+
+
+def _notify_sockets(socket_dir):
+    try:
+        paths = [
+            entry.path
+            for entry in os.scandir(socket_dir)
+            if entry.name.endswith(".sock")
+        ]
+    except FileNotFoundError:
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        for path in paths:
+            try:
+                sock.sendto(b"1", path)
+            except BlockingIOError:
+                pass  # The worker already has notifications waiting
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that didn't exit cleanly
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def notify():
+    """Wake up the workers that are waiting for jobs"""
+    try:
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("NOTIFY tram_jobs")
+        elif hasattr(socket, "AF_UNIX"):
+            _notify_sockets(settings.ML_WORKER_SOCKET_DIR)
+    except Exception:
+        # Workers will still find the job when they next poll
+        logger.warning("Failed to notify workers of a queued job", exc_info=True)
@@ -3,11 +3,13 @@ import os
 from constance import config
 from django.contrib.auth.models import User
 from django.core.files import File
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.db.models import Count, Q
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_save
 from django.dispatch.dispatcher import receiver
 
+from tram.ml import wakeup
+
 DISPOSITION_CHOICES = (
     ("accept", "Accepted"),
     ("reject", "Rejected"),
@@ -16,6 +18,14 @@ DISPOSITION_CHOICES = (
 
 JOB_STATUS_CHOICES = (
     ("queued", "Queued"),
+    ("processing", "Processing"),
+    ("error", "Error"),
+)
+
+TRAINING_JOB_STATUS_CHOICES = (
+    ("queued", "Queued"),
+    ("training", "Training"),
+    ("done", "Done"),
     ("error", "Error"),
 )
 
@@ -83,10 +93,20 @@ class DocumentProcessingJob(models.Model):
         max_length=255, default="queued", choices=JOB_STATUS_CHOICES
     )
     message = models.CharField(max_length=16384, default="")
+    # Time spent in each processing stage, see tram.ml.base.ModelManager.run_job()
+    timings = models.JSONField(null=True, blank=True)
+    # The pipeline worker processing the job, which may be reclaimed by another
+    # worker once the lease expires, see tram.ml.base.ModelManager.claim_job()
+    worker_id = models.CharField(max_length=255, blank=True, default="")
+    lease_expires_on = models.DateTimeField(null=True, blank=True)
     created_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Serves the queue depth and oldest queued job metrics without a table scan
+        indexes = [models.Index(fields=["status", "created_on"])]
+
     @classmethod
     def create_from_file(cls, f, u):
         """
@@ -109,6 +129,75 @@ class DocumentProcessingJob(models.Model):
         return "Process %s" % self.document.docfile.name
 
 
+class TrainingJob(models.Model):
+    """Queue of model training jobs"""
+
+    model_key = models.CharField(max_length=200)
+    incremental = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=255, default="queued", choices=TRAINING_JOB_STATUS_CHOICES
+    )
+    phase = models.CharField(max_length=200, blank=True, default="")
+    message = models.CharField(max_length=16384, default="")
+    metrics = models.JSONField(null=True, blank=True)
+    # The trainer running the job, which may be reclaimed by another trainer once
+    # the lease expires, see tram.ml.base.ModelManager.claim_training_job()
+    worker_id = models.CharField(max_length=255, blank=True, default="")
+    lease_expires_on = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
+    created_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(auto_now=True)
+    started_on = models.DateTimeField(null=True, blank=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_key"],
+                condition=Q(status="queued"),
+                name="unique_queued_training_job",
+            )
+        ]
+
+    @classmethod
+    def enqueue(cls, model_key, incremental=False, user=None):
+        """
+        Queues training for a model. A request for a model that already has a queued
+        job is merged into that job; a full training request turns a queued
+        incremental job into a full one.
+
+        There is at most one queued job per model (see Meta.constraints), so
+        concurrent requests can't both create one, on any database.
+
+        :return: A tuple of (job, created)
+        """
+        while True:
+            job = cls.objects.filter(model_key=model_key, status="queued").first()
+            if job is None:
+                try:
+                    with transaction.atomic():
+                        job = cls.objects.create(
+                            model_key=model_key,
+                            incremental=incremental,
+                            created_by=user,
+                        )
+                    return job, True
+                except IntegrityError:
+                    continue  # Another request queued a job for the model first
+
+            if job.incremental and not incremental:
+                upgraded = cls.objects.filter(id=job.id, status="queued").update(
+                    incremental=False
+                )
+                if not upgraded:
+                    continue  # A trainer started the job in the meantime
+                job.incremental = False
+            return job, False
+
+    def __str__(self):
+        return "Train %s" % self.model_key
+
+
 class Report(models.Model):
     """Store reports"""
 
@@ -116,6 +205,8 @@ class Report(models.Model):
     document = models.ForeignKey(Document, null=True, on_delete=models.CASCADE)
     text = models.TextField()
     ml_model = models.CharField(max_length=200)
+    # Time spent in each processing stage, see tram.ml.base.ModelManager.run_job()
+    timings = models.JSONField(null=True, blank=True)
     created_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
@@ -124,6 +215,30 @@ class Report(models.Model):
         return self.name
 
 
+class PredictionCacheEntry(models.Model):
+    """The mappings proposed for a sentence by a model version, see tram.ml.base.PredictionCache"""
+
+    key = models.CharField(max_length=64, unique=True)
+    model_name = models.CharField(max_length=200)
+    model_version = models.CharField(max_length=200)
+    mappings = models.JSONField()
+    created_on = models.DateTimeField(auto_now_add=True)
+    last_used_on = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return "%s@%s: %s" % (self.model_name, self.model_version, self.key)
+
+
+class PipelineMetric(models.Model):
+    """A cumulative pipeline metric series, see tram.ml.metrics"""
+
+    key = models.CharField(max_length=255, unique=True)
+    value = models.FloatField(default=0.0)
+
+    def __str__(self):
+        return "%s %s" % (self.key, self.value)
+
+
 class Indicator(models.Model):
     """Indicators extracted from a document for a report"""
 
@@ -173,13 +288,20 @@ class Mapping(models.Model):
         return 'Sentence "%s" to %s' % (self.sentence, self.attack_object)
 
     @classmethod
-    def get_accepted_mappings(cls):
+    def get_accepted_mappings(cls, since=None):
+        """
+        since - Only return mappings that were created after this datetime. Mappings
+                that existed when a model was trained at `since` were used to train
+                it, even if they or their sentence were changed later.
+        """
         # Get Attack techniques that have the required amount of positive examples
         attack_objects = AttackObject.get_sentence_counts(
             accept_threshold=config.ML_ACCEPT_THRESHOLD
         )
         # Get mappings for the attack techniques above threshold
         mappings = Mapping.objects.filter(attack_object__in=attack_objects)
+        if since is not None:
+            mappings = mappings.filter(created_on__gt=since)
         return mappings
 
 
@@ -197,3 +319,10 @@ def _delete_file(path):
 def delete_file_post_delete(sender, instance, *args, **kwargs):
     if instance.docfile:
         _delete_file(instance.docfile.path)
+
+
+@receiver(post_save, sender=DocumentProcessingJob)
+def notify_workers_post_save(sender, instance, *args, **kwargs):
+    # Wake up the pipeline workers once the job is visible to them
+    if instance.status == "queued":
+        transaction.on_commit(wakeup.notify)
@@ -1,4 +1,5 @@
 from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 
 from tram import models as db_models
@@ -25,10 +26,12 @@ class DocumentProcessingJobSerializer(serializers.ModelSerializer):
             "byline",
             "status",
             "message",
+            "timings",
             "created_by",
             "created_on",
             "updated_on",
         ]
+        read_only_fields = ["timings"]
         order = ["-created_on"]
 
     def get_name(self, obj):
@@ -45,12 +48,42 @@ class DocumentProcessingJobSerializer(serializers.ModelSerializer):
     def get_status(self, obj):
         if obj.status == "queued":
             return "Queued"
+        elif obj.status == "processing":
+            return "Processing"
         elif obj.status == "error":
             return "Error"
         else:
             return "Unknown"
 
 
+class TrainingJobSerializer(serializers.ModelSerializer):
+    elapsed_sec = serializers.SerializerMethodField()
+
+    class Meta:
+        model = db_models.TrainingJob
+        fields = [
+            "id",
+            "model_key",
+            "incremental",
+            "status",
+            "phase",
+            "message",
+            "metrics",
+            "elapsed_sec",
+            "created_by",
+            "created_on",
+            "started_on",
+            "finished_on",
+        ]
+        order = ["-created_on"]
+
+    def get_elapsed_sec(self, obj):
+        if obj.started_on is None:
+            return None
+        finished_on = obj.finished_on or timezone.now()
+        return (finished_on - obj.started_on).total_seconds()
+
+
 class MappingSerializer(serializers.ModelSerializer):
     attack_id = serializers.SerializerMethodField()
     name = serializers.SerializerMethodField()
@@ -120,11 +153,13 @@ class ReportSerializer(serializers.ModelSerializer):
             "total_sentences",
             "text",
             "ml_model",
+            "timings",
             "created_by",
             "created_on",
             "updated_on",
             "status",
         ]
+        read_only_fields = ["timings"]
         order = ["-created_on"]
 
     def get_accepted_sentences(self, obj):
@@ -124,6 +124,16 @@ CONSTANCE_CONFIG = {
         "Exclude proposed mappings below this confidence threshold",
         int,
     ),
+    "ML_MAX_MAPPINGS_PER_SENTENCE": (
+        0,
+        "Propose at most this many mappings per sentence (0 means no limit)",
+        int,
+    ),
+    "ML_CASCADE_GATE": (
+        25,
+        "Cascade model: send a sentence to the second-stage model if its best screen confidence is at least this",
+        int,
+    ),
 }
 
 MIDDLEWARE = [
@@ -168,6 +178,8 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": DATA_DIRECTORY / "db.sqlite3",
+        # Seconds to wait for another process's write, e.g. by other pipeline workers
+        "OPTIONS": {"timeout": 20},
     }
 }
 
@@ -226,4 +238,76 @@ SIMPLE_JWT = {
 
 ML_MODEL_DIR = os.path.join(DATA_DIRECTORY, "ml-models")
 
+# Save the large arrays of trained models as separate files that are memory-mapped
+# when a model is loaded. False saves models as a single pickle.
+ML_MODEL_MMAP = True
+
+# Maximum number of loaded models that each process keeps in memory. Cached models
+# are reloaded when their file changes.
+ML_MODEL_CACHE_SIZE = 8
+
+# Maximum number of sentences scored per predict_proba() call while processing a
+# report. Bounds memory for very large documents; None scores a report in one call.
+ML_INFERENCE_CHUNK_SIZE = 1000
+
+# Maximum number of sentences whose proposed mappings are cached in the database, so
+# that sentences repeated across reports (disclaimers, banners...) aren't scored again.
+# The least recently used entries are evicted first. 0 disables the cache.
+ML_PREDICTION_CACHE_SIZE = 100000
+
+# Maximum number of distinct tokens kept in the process-wide lemmatizer cache.
+ML_LEMMATIZER_CACHE_SIZE = 100000
+
+# Number of worker processes used to preprocess the training corpus, and the number
+# of sentences sent to a worker at a time. 1 preprocesses serially in this process.
+ML_PREPROCESS_WORKERS = int(os.environ.get("ML_PREPROCESS_WORKERS", 1))
+ML_PREPROCESS_CHUNK_SIZE = 2000
+
+# Number of accepted mappings fetched from the database at a time while loading the
+# training data, which keeps memory flat for large corpora.
+ML_TRAINING_LOAD_CHUNK_SIZE = 2000
+
+# Number of features produced by the hashing feature stage of the *_hash models.
+# Model size grows with this value times the number of techniques, not with the corpus.
+ML_HASHING_N_FEATURES = 2**15
+
+# Fit models with stateless features and partial_fit() support in chunks of this many
+# rows, so the whole feature matrix is never held in memory. None fits in one call.
+ML_TRAIN_CHUNK_SIZE = None
+
+# Evaluate models with stratified k-fold cross-validation using this many folds,
+# fit in parallel on ML_EVALUATION_N_JOBS processes (-1 uses all cores).
+# None evaluates on a single 80/20 train/test split.
+ML_EVALUATION_FOLDS = None
+ML_EVALUATION_N_JOBS = -1
+
+# Retrain models whose classifier supports it (logreg, nn_cls, sgd_hash) starting from
+# the weights of the saved model rather than from scratch, when the techniques haven't
+# changed. Evaluation is always fit from scratch.
+ML_WARM_START = False
+
+# Fit identical (sentence, technique) training rows as one row weighted by its count,
+# for the classifiers where that gives the same model with fewer rows (naive Bayes,
+# logistic regression and dummy). Stochastic classifiers (SGD, MLP) always fit every row.
+ML_COMPACT_TRAINING_DATA = True
+
+# `pipeline run --run-forever` workers are woken up as soon as a document is queued,
+# by a LISTEN/NOTIFY on PostgreSQL or a datagram on a Unix socket in
+# ML_WORKER_SOCKET_DIR for other databases on the same host. While the queue is empty
+# they also poll for jobs, backing off from the minimum to the maximum interval.
+ML_WORKER_SOCKET_DIR = os.path.join(DATA_DIRECTORY, "pipeline-workers")
+ML_WORKER_POLL_MIN_SECONDS = 1
+ML_WORKER_POLL_MAX_SECONDS = 30
+
+# A pipeline worker claims a job for this many seconds, renewed as each processing
+# stage starts and after each ML_INFERENCE_CHUNK_SIZE sentences are classified. A job
+# whose worker stops renewing its claim (e.g. because it was killed) is processed by
+# another worker once the claim expires.
+ML_WORKER_LEASE_SECONDS = 600
+
+# As ML_WORKER_LEASE_SECONDS, for a trainer processing a training job. The claim is
+# renewed as each training stage starts, and every third of this time while the
+# model trains.
+ML_TRAINING_LEASE_SECONDS = 3600
+
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
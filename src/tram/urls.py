@@ -33,6 +33,7 @@ router.register(
     r"report-mappings", views.ReportMappingViewSet, basename="report-mapping"
 )
 router.register(r"sentences", views.SentenceViewSet)
+router.register(r"training-jobs", views.TrainingJobViewSet)
 
 
 urlpatterns = [
@@ -46,6 +47,7 @@ urlpatterns = [
     path("docs/", TemplateView.as_view(template_name="tram_documentation.html")),
     path("login/", auth_views.LoginView.as_view()),
     path("logout/", auth_views.LogoutView.as_view()),
+    path("metrics", views.pipeline_metrics),
     path("upload/", views.upload),
     path("admin/", admin.site.urls),
     path("ml/", views.ml_home),
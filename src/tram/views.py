@@ -1,19 +1,19 @@
 import json
 import logging
-import time
 from urllib.parse import quote
 
 from constance import config
 from django.contrib.auth.decorators import login_required
 from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 from rest_framework import renderers, viewsets
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 from tram import serializers
-from tram.ml import base
+from tram.ml import base, metrics
 from tram.models import (
     AttackObject,
     Document,
@@ -21,6 +21,7 @@ from tram.models import (
     Mapping,
     Report,
     Sentence,
+    TrainingJob,
 )
 from tram.renderers import DocxReportRenderer
 
@@ -37,6 +38,11 @@ class DocumentProcessingJobViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.DocumentProcessingJobSerializer
 
 
+class TrainingJobViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = TrainingJob.objects.all()
+    serializer_class = serializers.TrainingJobSerializer
+
+
 class MappingViewSet(viewsets.ModelViewSet):
     queryset = Mapping.objects.all()
     serializer_class = serializers.MappingSerializer
@@ -54,6 +60,21 @@ class ReportViewSet(viewsets.ModelViewSet):
     queryset = Report.objects.all()
     serializer_class = serializers.ReportSerializer
 
+    def get_queryset(self):
+        queryset = ReportViewSet.queryset
+        slower_than = self.request.query_params.get("slower-than", None)
+        if slower_than:
+            try:
+                slower_than = float(slower_than)
+            except ValueError:
+                raise ValidationError({"slower-than": "Must be a number of seconds"})
+            # Slowest first, see ModelManager.run_job() for the timings
+            queryset = queryset.filter(timings__total_seconds__gt=slower_than).order_by(
+                "-timings__total_seconds"
+            )
+
+        return queryset
+
 
 class ReportMappingViewSet(viewsets.ModelViewSet):
     """
@@ -175,6 +196,8 @@ def ml_home(request):
         "techniques": techniques,
         "ML_ACCEPT_THRESHOLD": config.ML_ACCEPT_THRESHOLD,
         "ML_CONFIDENCE_THRESHOLD": config.ML_CONFIDENCE_THRESHOLD,
+        "ML_MAX_MAPPINGS_PER_SENTENCE": config.ML_MAX_MAPPINGS_PER_SENTENCE,
+        "ML_CASCADE_GATE": config.ML_CASCADE_GATE,
         "models": model_metadata,
     }
 
@@ -233,30 +256,51 @@ def download_document(request, doc_id):
     return response
 
 
+@require_GET
+def pipeline_metrics(request):
+    """
+    Pipeline metrics in the Prometheus text format, for monitoring the queue and
+    autoscaling workers. Doesn't require a login so that it can be scraped; it only
+    exposes counts and timings.
+    """
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @api_view(["POST"])
 def train_model(request, name):
     """
-    Train the specified model.
+    Queue training for the specified model.
 
-    Runs training synchronously and returns a response when the training is
-    complete.
+    Returns immediately with the id of a training job that is processed by the
+    `pipeline run-training` worker; its progress is available at
+    /api/training-jobs/<id>/. A request for a model that is already queued for
+    training is merged into the queued job. Post incremental=true to only train on
+    the mappings created since the model was last trained, if the model supports it.
 
     :param name: the name of the model
     """
-    try:
-        model = base.ModelManager(name)
-    except ValueError:
+    if name not in base.ModelManager.model_registry:
         raise Http404("Model does not exist")
 
-    logger.info(f"Training ML Model: {name}")
-    start = time.time()
-    model.train_model()
-    elapsed = time.time() - start
-    logger.info("Trained ML model in %0.3f seconds", elapsed)
+    incremental = str(request.data.get("incremental", "")).lower() in (
+        "true",
+        "1",
+        "t",
+        "yes",
+        "y",
+    )
+
+    job, created = TrainingJob.enqueue(name, incremental, request.user)
+    if created:
+        logger.info("Queued training job #%d for ML Model: %s", job.id, name)
 
     return Response(
         {
-            "message": "Model successfully trained.",
-            "elapsed_sec": elapsed,
-        }
+            "message": "Model training queued."
+            if created
+            else "Model training already queued.",
+            "job_id": job.id,
+            "status": job.status,
+        },
+        status=202,
     )
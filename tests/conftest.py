@@ -34,6 +34,9 @@ def django_db_setup(django_db_setup, django_db_blocker):
         tram.settings.DATA_DIRECTORY = str(data_directory)
         media_root = data_directory / "media"
         media_root.mkdir(parents=True)
+        # Keep tests from writing models and the corpus cache to the real data directory
+        ml_model_dir = data_directory / "ml-models"
+        ml_model_dir.mkdir()
 
         with django_db_blocker.unblock():
             attackdata.Command().handle(subcommand=attackdata.LOAD)
@@ -42,7 +45,11 @@ def django_db_setup(django_db_setup, django_db_blocker):
                 file="tests/data/test-training-data.json",
             )
 
-        settings = {"MEDIA_ROOT": str(media_root), "SECRET_KEY": "UNITTEST"}
+        settings = {
+            "MEDIA_ROOT": str(media_root),
+            "ML_MODEL_DIR": str(ml_model_dir),
+            "SECRET_KEY": "UNITTEST",
+        }
 
         with override_settings(**settings):
             yield
@@ -0,0 +1,86 @@
+import os
+import pickle
+import stat
+
+import numpy as np
+
+from tram.ml import artifacts
+
+
+class TestArtifacts:
+    def test_round_trip_memory_maps_large_arrays(self, tmpdir):
+        # Arrange
+        filepath = str(tmpdir / "model.pkl")
+        obj = {"large": np.arange(10000, dtype=np.float64), "small": np.arange(3)}
+
+        # Act
+        artifacts.dump(obj, filepath, "v1")
+        loaded = artifacts.load(filepath)
+
+        # Assert
+        assert isinstance(loaded["large"], np.memmap)
+        assert not isinstance(loaded["small"], np.memmap)
+        assert (loaded["large"] == obj["large"]).all()
+        assert (loaded["small"] == obj["small"]).all()
+
+    def test_loaded_arrays_are_copy_on_write(self, tmpdir):
+        # Arrange
+        filepath = str(tmpdir / "model.pkl")
+        artifacts.dump({"large": np.zeros(10000)}, filepath, "v1")
+
+        # Act
+        loaded = artifacts.load(filepath)
+        loaded["large"] += 1
+        reloaded = artifacts.load(filepath)
+
+        # Assert
+        assert (reloaded["large"] == 0).all()
+
+    def test_saving_keeps_previous_version_loadable(self, tmpdir):
+        # Arrange
+        filepath = str(tmpdir / "model.pkl")
+        artifacts.dump({"large": np.zeros(10000)}, filepath, "v1")
+        previous = str(tmpdir / "previous.pkl")
+        with open(filepath, "rb") as src, open(previous, "wb") as dst:
+            dst.write(src.read())
+
+        # Act
+        artifacts.dump({"large": np.ones(10000)}, filepath, "v2")
+        artifacts.dump({"large": np.ones(10000) * 2}, filepath, "v3")
+
+        # Assert
+        assert (artifacts.load(filepath)["large"] == 2).all()
+        assert sorted(os.listdir(artifacts.get_arrays_dir(filepath))) == ["v2", "v3"]
+        assert not [f for f in os.listdir(str(tmpdir)) if f.endswith(".tmp")]
+
+    def test_load_reads_plain_pickles(self, tmpdir):
+        # Arrange
+        filepath = str(tmpdir / "model.pkl")
+        obj = {"large": np.arange(10000)}
+        with open(filepath, "wb") as f:
+            pickle.dump(obj, f)
+
+        # Act
+        loaded = artifacts.load(filepath)
+
+        # Assert
+        assert (loaded["large"] == obj["large"]).all()
+
+    def test_atomic_open_creates_file_with_same_mode_as_open(self, tmpdir):
+        # Arrange
+        filepath = str(tmpdir / "model.pkl")
+        expected_filepath = str(tmpdir / "expected.pkl")
+        umask = os.umask(0o022)
+
+        # Act
+        try:
+            with artifacts.atomic_open(filepath) as f:
+                f.write(b"data")
+            with open(expected_filepath, "wb") as f:
+                f.write(b"data")
+        finally:
+            os.umask(umask)
+
+        # Assert
+        assert stat.S_IMODE(os.stat(filepath).st_mode) == 0o644
+        assert os.stat(filepath).st_mode == os.stat(expected_filepath).st_mode
@@ -1,7 +1,15 @@
+import copy
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
 import pytest
 from constance import config
 from django.contrib.auth.models import User
 from django.core.files import File
+from django.db import DatabaseError, connection, connections
+from django.db.models import QuerySet
 
 import tram.models as db_models
 from tram.ml import base
@@ -176,7 +184,10 @@ class TestSkLearnModel:
             dummy_model.get_attack_object_ids() == dummy_model_2.get_attack_object_ids()
         )
 
-    def test_get_training_data(self, dummy_model):
+    def test_get_training_data(self, dummy_model, settings, tmpdir):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+
         # Act
         X, y = dummy_model.get_training_data()
 
@@ -184,6 +195,66 @@ class TestSkLearnModel:
         assert len(X) == 163
         assert len(y) == 163
 
+    def test__select_mappings_applies_confidence_threshold(self, dummy_model):
+        # Arrange
+        probs = [[0.1, 0.6, 0.3], [0.05, 0.05, 0.9]]
+        techniques = ["T1001", "T1002", "T1003"]
+
+        # Act
+        mappings = dummy_model._select_mappings(probs, techniques, threshold=25)
+
+        # Assert
+        assert [[m.attack_id for m in row] for row in mappings] == [
+            ["T1002", "T1003"],
+            ["T1003"],
+        ]
+        assert mappings[0][0].confidence == pytest.approx(60.0)
+
+    def test__select_mappings_applies_max_mappings(self, dummy_model):
+        # Arrange
+        probs = [[0.4, 0.1, 0.2, 0.3], [0.0, 0.0, 0.0, 0.0]]
+        techniques = ["T1001", "T1002", "T1003", "T1004"]
+
+        # Act
+        mappings = dummy_model._select_mappings(
+            probs, techniques, threshold=0, max_mappings=2
+        )
+
+        # Assert
+        assert [m.attack_id for m in mappings[0]] == ["T1001", "T1004"]
+        assert len(mappings[1]) == 2
+
+    def test_get_training_data_is_unchanged_by_corpus_cache(
+        self, dummy_model, settings, tmpdir, mocker
+    ):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        X1, y1 = dummy_model.get_training_data()
+        spy = mocker.spy(base.preprocessing, "lemmatize_sentences")
+
+        # Act
+        X2, y2 = dummy_model.get_training_data()
+
+        # Assert
+        assert spy.call_args[0][0] == []  # Every sentence was read from the cache
+        assert X1 == X2
+        assert y1 == y2
+
+    def test_get_training_data_only_reads_text_of_uncached_sentences(
+        self, dummy_model, settings, tmpdir, django_assert_num_queries
+    ):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        expected = dummy_model.get_training_data()
+
+        # Act
+        # One query for ML_ACCEPT_THRESHOLD, one for the mappings, none for the text
+        with django_assert_num_queries(2):
+            X, y = dummy_model.get_training_data()
+
+        # Assert
+        assert (X, y) == expected
+
     def test_non_sklearn_pipeline_raises(self):
         # Arrange
         class NonSKLearnPipeline(base.SKLearnModel):
@@ -213,8 +284,9 @@ class TestsThatNeedTrainingData:
         with pytest.raises(ValueError):
             base.ModelManager("this-should-raise")
 
-    def test_modelmanager_train_model_doesnt_raise(self):
+    def test_modelmanager_train_model_doesnt_raise(self, settings, tmpdir):
         # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
         model_manager = base.ModelManager("dummy")
 
         # Act
@@ -223,6 +295,338 @@ class TestsThatNeedTrainingData:
         # Assert
         # TODO: Something meaningful
 
+    def test_modelmanager_train_model_rebuild_cache_clears_corpus_cache(self, mocker):
+        # Arrange
+        model_manager = base.ModelManager("dummy")
+        mock_clear = mocker.patch.object(base.preprocessing.CorpusCache, "clear")
+
+        # Act
+        model_manager.train_model(rebuild_cache=True)
+
+        # Assert
+        mock_clear.assert_called_once()
+
+    def test_modelmanager_train_model_incremental_falls_back_to_full_training(
+        self, mocker
+    ):
+        # Arrange
+        model_manager = base.ModelManager("dummy")
+        mock_train = mocker.patch.object(base.DummyModel, "train")
+        mocker.patch.object(base.DummyModel, "test")
+
+        # Act
+        model_manager.train_model(incremental=True)
+
+        # Assert
+        mock_train.assert_called_once()
+
+    def test_modelmanager_train_models_saves_each_model(self, settings, tmpdir, mocker):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        model_keys = ["dummy", "nb", "cascade"]
+        close_all = mocker.spy(base.connections, "close_all")
+
+        # Act
+        elapsed = base.ModelManager.train_models(model_keys)
+
+        # Assert
+        assert list(elapsed) == model_keys
+        assert (tmpdir / "DummyModel.pkl").exists()
+        assert (tmpdir / "NaiveBayesModel.pkl").exists()
+        assert (tmpdir / "CascadeModel.pkl").exists()
+        close_all.assert_called_once()
+
+    def test_modelmanager_train_models_warm_starts(self, settings, tmpdir):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        base.ModelManager("logreg").train_model()
+
+        # Act
+        base.ModelManager.train_models(["dummy", "logreg"], warm_start=True)
+
+        # Assert
+        assert base.ModelManager("logreg").model.fit_stats["warm_start"]
+
+    def test_modelmanager__init__reuses_cached_model(self, settings, tmpdir):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        base.ModelManager("dummy").train_model()
+        first = base.ModelManager("dummy")
+        hits = base.ModelManager.model_cache.hits
+
+        # Act
+        second = base.ModelManager("dummy")
+
+        # Assert
+        assert second.model is first.model
+        assert base.ModelManager.model_cache.hits == hits + 1
+
+    def test_model_cache_evicts_least_recently_used_model(self, settings, tmpdir):
+        # Arrange
+        settings.ML_MODEL_CACHE_SIZE = 2
+        cache = base.ModelCache(max_entries=settings.ML_MODEL_CACHE_SIZE)
+        model_classes = [
+            base.DummyModel,
+            base.NaiveBayesModel,
+            base.LogisticRegressionModel,
+        ]
+        filepaths = {}
+        for model_class in model_classes:
+            filepaths[model_class] = str(tmpdir / (model_class.__name__ + ".pkl"))
+            model_class().save_to_file(filepaths[model_class])
+        first = cache.load(base.DummyModel, filepaths[base.DummyModel])
+        cache.load(base.NaiveBayesModel, filepaths[base.NaiveBayesModel])
+
+        # Act
+        # DummyModel is used again, so NaiveBayesModel is the least recently used
+        cache.load(base.DummyModel, filepaths[base.DummyModel])
+        cache.load(
+            base.LogisticRegressionModel, filepaths[base.LogisticRegressionModel]
+        )
+
+        # Assert
+        assert list(cache.entries) == [base.DummyModel, base.LogisticRegressionModel]
+        assert cache.load(base.DummyModel, filepaths[base.DummyModel]) is first
+        assert cache.stats() == {
+            "hits": 2,
+            "misses": 3,
+            "entries": 2,
+            "max_entries": 2,
+        }
+
+    def test_modelmanager_reload_model_logs_cache_stats(self, settings, tmpdir, mocker):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        base.ModelManager("dummy").train_model()
+        model_manager = base.ModelManager("dummy")
+        debug = mocker.spy(base.logger, "debug")
+
+        # Act
+        model_manager.reload_model()
+
+        # Assert
+        debug.assert_any_call("Model cache: %s", base.ModelManager.model_cache.stats())
+
+    def test_modelmanager__init__reloads_changed_model(self, settings, tmpdir):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        base.ModelManager("dummy").train_model()
+        first = base.ModelManager("dummy")
+
+        # Act
+        base.ModelManager("dummy").train_model()
+        second = base.ModelManager("dummy")
+
+        # Assert
+        assert second.model is not first.model
+        assert second.model.last_trained > first.model.last_trained
+
+    def test_modelmanager_run_training_jobs_trains_queued_models(
+        self, settings, tmpdir
+    ):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        job, _ = db_models.TrainingJob.enqueue("dummy")
+
+        # Act
+        base.ModelManager.run_training_jobs()
+        job.refresh_from_db()
+
+        # Assert
+        assert job.status == "done"
+        assert job.metrics["version"] == base.ModelManager("dummy").model.version
+        assert "fit" in job.metrics["timings"]
+        assert job.finished_on >= job.started_on
+
+    def test_modelmanager_run_training_jobs_records_errors(self, mocker):
+        # Arrange
+        mocker.patch.object(
+            base.ModelManager, "train_model", side_effect=ValueError("Boom")
+        )
+        job, _ = db_models.TrainingJob.enqueue("dummy")
+
+        # Act
+        base.ModelManager.run_training_jobs()
+        job.refresh_from_db()
+
+        # Assert
+        assert job.status == "error"
+        assert job.message == "Boom"
+
+    def test_training_job_enqueue_loses_race_to_other_request(self, mocker):
+        # Arrange
+        first = QuerySet.first
+        other_jobs = []
+
+        def first_then_other_request_queues(queryset):
+            job = first(queryset)
+            if queryset.model is db_models.TrainingJob and not other_jobs:
+                # Another request queues a job between this request's read and insert
+                other_jobs.append(db_models.TrainingJob.objects.create(model_key="nb"))
+            return job
+
+        mocker.patch.object(QuerySet, "first", first_then_other_request_queues)
+
+        # Act
+        job, created = db_models.TrainingJob.enqueue("nb", incremental=True)
+
+        # Assert
+        assert not created
+        assert job.id == other_jobs[0].id
+        assert db_models.TrainingJob.objects.filter(model_key="nb").count() == 1
+
+    def test_modelmanager_run_training_jobs_reclaims_job_with_expired_lease(
+        self, settings, tmpdir
+    ):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        now = datetime.now(timezone.utc)
+        dead, _ = db_models.TrainingJob.enqueue("dummy")
+        live, _ = db_models.TrainingJob.enqueue("nb")
+        db_models.TrainingJob.objects.filter(id=dead.id).update(
+            status="training",
+            worker_id="dead-trainer",
+            lease_expires_on=now - timedelta(seconds=1),
+        )
+        db_models.TrainingJob.objects.filter(id=live.id).update(
+            status="training",
+            worker_id="live-trainer",
+            lease_expires_on=now + timedelta(seconds=60),
+        )
+
+        # Act
+        base.ModelManager.run_training_jobs()
+        dead.refresh_from_db()
+        live.refresh_from_db()
+
+        # Assert
+        assert dead.status == "done"
+        assert dead.worker_id != "dead-trainer"
+        assert dead.lease_expires_on is None
+        assert live.status == "training"
+
+    def test_modelmanager_run_training_job_renews_lease_each_phase(self, mocker):
+        # Arrange
+        db_models.TrainingJob.enqueue("dummy")
+        job = base.ModelManager.claim_training_job("this-trainer")
+        expiring = datetime.now(timezone.utc) + timedelta(seconds=1)
+        db_models.TrainingJob.objects.filter(id=job.id).update(
+            lease_expires_on=expiring
+        )
+        leases = []
+
+        def train_model(incremental=False, timer=None):
+            with timer.phase("fit"):
+                leases.append(
+                    db_models.TrainingJob.objects.get(id=job.id).lease_expires_on
+                )
+
+        mocker.patch.object(base.ModelManager, "train_model", side_effect=train_model)
+
+        # Act
+        base.ModelManager.run_training_job(job, "this-trainer")
+        job.refresh_from_db()
+
+        # Assert
+        assert leases[0] > expiring
+        assert job.status == "done"
+
+    def test_modelmanager_run_training_job_renews_lease_during_long_phase(
+        self, file_database, settings, mocker
+    ):
+        # Arrange
+        settings.ML_TRAINING_LEASE_SECONDS = 0.3
+        reclaimed = []
+
+        def slow_train_model(incremental=False, timer=None):
+            with timer.phase("fit"):
+                time.sleep(1)
+                reclaimed.append(base.ModelManager.claim_training_job("other-trainer"))
+
+        mocker.patch.object(
+            base.ModelManager, "train_model", side_effect=slow_train_model
+        )
+
+        def train():
+            db_models.TrainingJob.enqueue("dummy")
+            job = base.ModelManager.claim_training_job("this-trainer")
+            base.ModelManager.run_training_job(job, "this-trainer")
+            job.refresh_from_db()
+            return job
+
+        # Act
+        [job] = run_in_threads(train, ())
+
+        # Assert
+        assert reclaimed == [None]
+        assert job.status == "done"
+        assert job.worker_id == "this-trainer"
+
+    def test_modelmanager_reload_model_swaps_in_new_version(self, settings, tmpdir):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        base.ModelManager("dummy").train_model()
+        worker = base.ModelManager("dummy")
+        old_version = worker.model.version
+
+        # Act
+        base.ModelManager("dummy").train_model()
+        worker.reload_model()
+
+        # Assert
+        assert worker.model.version != old_version
+        assert worker.get_model_name() == "DummyModel@%s" % worker.model.version
+
+    def test_modelmanager_reload_model_keeps_model_if_load_fails(
+        self, settings, tmpdir, mocker
+    ):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        base.ModelManager("dummy").train_model()
+        worker = base.ModelManager("dummy")
+        model = worker.model
+        base.ModelManager("dummy").train_model()
+        mocker.patch.object(base.ModelCache, "load", side_effect=EOFError)
+
+        # Act
+        worker.reload_model()
+
+        # Assert
+        assert worker.model is model
+
+    def test_modelmanager_get_model_metadata_reads_metadata_file(
+        self, settings, tmpdir, mocker, django_assert_num_queries
+    ):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        base.ModelManager("nb").train_model()
+        base.ModelManager.model_cache.clear()
+        mock_load = mocker.patch.object(base.NaiveBayesModel, "load_from_file")
+
+        # Act
+        with django_assert_num_queries(1):
+            metadata = base.ModelManager.get_model_metadata("nb")
+
+        # Assert
+        mock_load.assert_not_called()
+        assert (tmpdir / "NaiveBayesModel.json").exists()
+        assert metadata["name"] == "NaiveBayesModel"
+        assert metadata["trained_techniques_count"] > 0
+        assert metadata["detailed_f1_score"][0]["technique_name"]
+
+    def test_modelmanager_get_model_metadata_for_untrained_model(
+        self, settings, tmpdir
+    ):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+
+        # Act
+        metadata = base.ModelManager.get_model_metadata("dummy")
+
+        # Assert
+        assert metadata["last_trained"] == "Never trained"
+        assert metadata["detailed_f1_score"] == []
+
     """
     ----- End ModelManager Tests -----
     """
@@ -241,6 +645,28 @@ class TestsThatNeedTrainingData:
         for mapping in mappings:
             assert isinstance(mapping, base.Mapping)
 
+    def test_get_mappings_for_sentences_matches_get_mappings(self):
+        # Arrange
+        nb_model = base.NaiveBayesModel()
+        nb_model.train()
+        config.ML_CONFIDENCE_THRESHOLD = 0
+        sentences = [
+            "The actor used PowerShell to download a payload.",
+            "Spearphishing emails delivered a malicious attachment.",
+            "This sentence is about nothing in particular.",
+        ]
+
+        # Act
+        batched = nb_model.get_mappings_for_sentences(sentences, chunk_size=2)
+        single = [nb_model.get_mappings(sentence) for sentence in sentences]
+
+        # Assert
+        assert len(batched) == len(sentences)
+        for batched_mappings, single_mappings in zip(batched, single):
+            assert [(m.attack_id, m.confidence) for m in batched_mappings] == [
+                (m.attack_id, m.confidence) for m in single_mappings
+            ]
+
     def test_process_job_produces_valid_report(self):
         # Arrange
         with open("tests/data/AA20-302A.docx", "rb") as f:
@@ -264,6 +690,83 @@ class TestsThatNeedTrainingData:
         assert report.text is not None
         assert len(report.sentences) > 0
 
+    def test_run_model_saves_timings_with_report(self, user):
+        # Arrange
+        with open("tests/data/AA20-302A.docx", "rb") as f:
+            processing_job = db_models.DocumentProcessingJob.create_from_file(
+                File(f), user
+            )
+        model_manager = base.ModelManager("dummy")
+        model_manager.model.train()
+
+        # Act
+        model_manager.run_model()
+        report = db_models.Report.objects.get(document=processing_job.document)
+        sentence_count = report.sentence_set.count()
+
+        # Cleanup
+        processing_job.document.delete()
+
+        # Assert
+        assert list(report.timings["seconds"]) == [
+            "extract",
+            "tokenize",
+            "classify",
+            "save",
+        ]
+        assert report.timings["sentences"] == sentence_count
+        assert report.timings["document_bytes"] > 0
+        assert (
+            db_models.PipelineMetric.objects.get(
+                key='tram_jobs_processed_total{result="success"}'
+            ).value
+            == 1
+        )
+
+    def test_run_model_forever_wakes_up_for_queued_job(self, user, mocker):
+        # Arrange
+        class StopWorker(Exception):
+            pass
+
+        class Listener:
+            def __init__(self):
+                self.timeouts = []
+                self.jobs = []
+                self.closed = False
+
+            def wait(self, timeout):
+                self.timeouts.append(timeout)
+                if len(self.timeouts) > 1:
+                    raise StopWorker()
+                # A document is uploaded while the worker waits
+                with open("tests/data/simple-test.docx", "rb") as f:
+                    self.jobs.append(
+                        db_models.DocumentProcessingJob.create_from_file(File(f), user)
+                    )
+                return True
+
+            def close(self):
+                self.closed = True
+
+        listener = Listener()
+        mocker.patch.object(base.wakeup, "get_listener", return_value=listener)
+        model_manager = base.ModelManager("dummy")
+        model_manager.model.train()
+
+        # Act
+        with pytest.raises(StopWorker):
+            model_manager.run_model(run_forever=True)
+        document = listener.jobs[0].document
+        report_exists = db_models.Report.objects.filter(document=document).exists()
+
+        # Cleanup
+        document.delete()
+
+        # Assert
+        assert report_exists
+        assert listener.timeouts == [1, 1]
+        assert listener.closed
+
     def test_process_job_handles_image_based_pdf(self, user):
         """
         Some PDFs can be saved such that the text is stored as images and therefore
@@ -288,6 +791,382 @@ class TestsThatNeedTrainingData:
         # Assert
         assert job_result.status == "error"
         assert len(job_result.message) > 0
+        assert "extract" in job_result.timings["seconds"]
+        assert job_result.timings["document_bytes"] > 0
+
+    def test_train_incremental_updates_classifier_with_new_mappings(self, mocker):
+        # Arrange
+        nb_model = base.NaiveBayesModel()
+        nb_model.train()
+        last_trained = nb_model.last_trained
+        mapping = db_models.Mapping.get_accepted_mappings().first()
+        sentence = mapping.sentence
+        new_sentence = db_models.Sentence.objects.create(
+            text=sentence.text, report=sentence.report, disposition="accept"
+        )
+        db_models.Mapping.objects.create(
+            report=sentence.report,
+            sentence=new_sentence,
+            attack_object=mapping.attack_object,
+            confidence=100.0,
+        )
+        classifier = nb_model.techniques_model.steps[-1][1]
+        class_count = classifier.class_count_.sum()
+        spy = mocker.spy(classifier, "partial_fit")
+
+        # Act
+        nb_model.train_incremental()
+
+        # Assert
+        spy.assert_called_once()
+        assert classifier.class_count_.sum() == class_count + 1
+        assert nb_model.last_trained > last_trained
+
+    def test_train_incremental_skips_resaved_mappings(self):
+        # Arrange
+        nb_model = base.NaiveBayesModel()
+        nb_model.train()
+        mapping = db_models.Mapping.get_accepted_mappings().first()
+        mapping.sentence.save()  # e.g. an analyst accepts or edits the sentence
+        mapping.save()
+        classifier = nb_model.techniques_model.steps[-1][1]
+        class_count = classifier.class_count_.sum()
+
+        # Act
+        nb_model.train_incremental()
+
+        # Assert
+        assert classifier.class_count_.sum() == class_count
+
+    def test_train_incremental_raises_for_unsupported_model(self, dummy_model):
+        # Act / Assert
+        with pytest.raises(ValueError):
+            dummy_model.train_incremental()
+
+    def test_fit_in_chunks_matches_fit_for_naive_bayes_hashing_model(self):
+        # Arrange
+        X, y = base.DummyModel().get_training_data()
+        full_model = base.NaiveBayesHashingModel()
+        chunked_model = base.NaiveBayesHashingModel()
+
+        # Act
+        full_model.techniques_model.fit(X, y)
+        chunked_model.fit_in_chunks(X, y, chunk_size=50)
+
+        # Assert
+        assert chunked_model.supports_chunked_training()
+        assert (
+            full_model.techniques_model.predict(X)
+            == chunked_model.techniques_model.predict(X)
+        ).all()
+
+    def test_chunked_retraining_starts_from_scratch(self, settings):
+        # Arrange
+        settings.ML_TRAIN_CHUNK_SIZE = 50
+        model = base.NaiveBayesHashingModel()
+        model.train()
+        class_count = model.techniques_model.steps[-1][1].class_count_.sum()
+
+        # Act
+        model.train()
+
+        # Assert
+        assert model.techniques_model.steps[-1][1].class_count_.sum() == class_count
+
+    @pytest.mark.parametrize("model_key", ["nb_hash", "sgd_hash"])
+    def test_hashing_models_train_and_score(self, model_key):
+        # Arrange
+        model = base.ModelManager.model_registry[model_key]()
+        model.train()
+        model.test()
+
+        # Act
+        mappings = model.get_mappings_for_sentences(["The actor used PowerShell."])
+
+        # Assert
+        assert model.has_stateless_features()
+        assert len(mappings) == 1
+
+    def test_compact_rows_collapses_identical_pairs(self):
+        # Arrange
+        X = ["a", "b", "a", "a", "b"]
+        y = ["T1", "T1", "T1", "T2", "T1"]
+
+        # Act
+        rows, counts = base.SKLearnModel.compact_rows(X, y)
+
+        # Assert
+        assert rows.tolist() == [0, 1, 3]
+        assert counts.tolist() == [2.0, 2.0, 1.0]
+
+    @pytest.mark.parametrize("model_key", ["dummy", "nb", "logreg"])
+    def test_train_with_compacted_rows_matches_train(self, settings, model_key):
+        # Arrange
+        X, y = base.NaiveBayesModel().get_training_data()
+        X, y = X * 3, y * 3
+        settings.ML_COMPACT_TRAINING_DATA = False
+        expected = base.ModelManager.model_registry[model_key]()
+        expected.train(X, y)
+        settings.ML_COMPACT_TRAINING_DATA = True
+        model = base.ModelManager.model_registry[model_key]()
+
+        # Act
+        model.train(X, y)
+
+        # Assert
+        assert model.fit_stats["rows"] == expected.fit_stats["rows"] / 3
+        sentences = ["The actor used PowerShell.", "The malware was a backdoor."]
+        assert model.techniques_model.predict_proba(sentences) == pytest.approx(
+            expected.techniques_model.predict_proba(sentences), abs=1e-3
+        )
+
+    @pytest.mark.parametrize(
+        "model_key,expected",
+        [
+            ("dummy", True),
+            ("nb", True),
+            ("logreg", True),
+            ("nn_cls", False),
+            ("sgd_hash", False),
+            ("cascade", False),
+        ],
+    )
+    def test_supports_compacted_training(self, model_key, expected):
+        # Arrange
+        model = base.ModelManager.model_registry[model_key]()
+
+        # Act / Assert
+        assert model.supports_compacted_training() == expected
+
+    def test_train_stochastic_classifier_fits_every_row(self, settings):
+        # Arrange
+        settings.ML_COMPACT_TRAINING_DATA = True
+        X, y = base.NaiveBayesModel().get_training_data()
+        X, y = X * 2, y * 2
+        model = base.SGDHashingModel()
+
+        # Act
+        model.train(X, y)
+
+        # Assert
+        assert model.fit_stats["rows"] == len(y)
+
+    def test_prediction_cache_scores_each_sentence_once(self, mocker):
+        # Arrange
+        model = base.LogisticRegressionModel()
+        model.train()
+        model.version = "v1"
+        sentences = [
+            "The actor used PowerShell.",
+            "Foo.",
+            "The  actor used PowerShell.",
+        ]
+        expected = model.get_mappings_for_sentences(sentences)
+        cache = base.PredictionCache(max_entries=100)
+        spy = mocker.spy(model, "get_mappings_for_sentences")
+
+        # Act
+        first = cache.get_mappings(model, sentences)
+        second = cache.get_mappings(model, sentences)
+
+        # Assert
+        assert len(spy.call_args_list[0].args[0]) == 2
+        assert spy.call_args_list[1].args[0] == []
+        for mappings in (first, second):
+            assert [[(m.attack_id, m.confidence) for m in ms] for ms in mappings] == [
+                [(m.attack_id, m.confidence) for m in ms] for ms in expected
+            ]
+
+    def test_prediction_cache_misses_for_new_model_version(self, mocker):
+        # Arrange
+        model = base.DummyModel()
+        model.train()
+        model.version = "v1"
+        cache = base.PredictionCache(max_entries=100)
+        cache.get_mappings(model, ["Foo."])
+        model.version = "v2"
+        spy = mocker.spy(model, "get_mappings_for_sentences")
+
+        # Act
+        cache.get_mappings(model, ["Foo."])
+        base.PredictionCache.purge(model)
+
+        # Assert
+        assert spy.call_args.args[0] == ["Foo."]
+        assert set(
+            db_models.PredictionCacheEntry.objects.values_list(
+                "model_version", flat=True
+            )
+        ) == {"v2"}
+
+    def test_prediction_cache_evicts_least_recently_used(self):
+        # Arrange
+        model = base.DummyModel()
+        model.train()
+        model.version = "v1"
+        cache = base.PredictionCache(max_entries=2)
+        cache.get_mappings(model, ["First."])
+        cache.get_mappings(model, ["Second."])
+        cache.get_mappings(model, ["First."])
+
+        # Act
+        cache.get_mappings(model, ["Third."])
+
+        # Assert
+        keys = set(db_models.PredictionCacheEntry.objects.values_list("key", flat=True))
+        key_prefix = cache.get_key_prefix(model)
+        assert keys == {
+            cache.get_key(key_prefix, "First."),
+            cache.get_key(key_prefix, "Third."),
+        }
+
+    def test_prediction_cache_queries_do_not_grow_with_sentences(
+        self, django_assert_num_queries
+    ):
+        # Arrange
+        model = base.CascadeModel()
+        model.train()
+        model.version = "v1"
+        sentences = ["Sentence number %d." % i for i in range(300)]
+        cache = base.PredictionCache(max_entries=1000)
+        cache.get_mappings(model, sentences)
+
+        # Act / Assert
+        # Settings for the key prefix (3), cache lookup, scoring no sentences (the
+        # cascade gate, confidence threshold and max mappings), last used update
+        # and eviction count
+        with django_assert_num_queries(9):
+            cache.get_mappings(model, sentences)
+
+    def test_cascade_model_routes_only_confident_sentences(self):
+        # Arrange
+        model = base.CascadeModel()
+        model.train()
+        model.test()
+        sentences = ["The actor used PowerShell.", "The weather was nice."] * 5
+        classifier = model.techniques_model.steps[-1][1]
+        features = model.techniques_model[:-1].transform(sentences)
+        screen_best = classifier.screen_.predict_proba(features).max(axis=1)
+
+        # Act
+        mappings = model.get_mappings_for_sentences(sentences)
+
+        # Assert
+        assert len(mappings) == len(sentences)
+        assert classifier.n_screened_ == len(sentences)
+        assert classifier.n_routed_ == (screen_best >= classifier.gate).sum()
+
+    @pytest.mark.parametrize("gate,routed", [(0.0, 10), (1.1, 0)])
+    def test_cascade_classifier_gate(self, gate, routed):
+        # Arrange
+        X, y = base.CascadeModel().get_training_data()
+        model = base.CascadeModel()
+        model.train(X, y)
+        classifier = model.techniques_model.steps[-1][1]
+        classifier.gate = gate
+        classifier.reset_routing_counts()
+
+        # Act
+        model.techniques_model.predict_proba(X[:10])
+
+        # Assert
+        assert classifier.n_routed_ == routed
+
+    @pytest.mark.parametrize("model_key", ["logreg", "nn_cls"])
+    def test_train_warm_starts_from_previous_model(self, model_key):
+        # Arrange
+        previous = base.ModelManager.model_registry[model_key]()
+        previous.train()
+        model = copy.deepcopy(previous)
+
+        # Act
+        model.train(warm_start_from=previous)
+
+        # Assert
+        classifier = model.techniques_model.steps[-1][1]
+        assert model.fit_stats["warm_start"]
+        assert model.cold_fit_stats == previous.fit_stats
+        assert not classifier.get_params()["warm_start"]
+        assert len(model.get_mappings_for_sentences(["The actor used PowerShell."]))
+
+    def test_warm_start_classifier_falls_back_when_techniques_change(self):
+        # Arrange
+        X, y = base.LogisticRegressionModel().get_training_data()
+        previous = base.LogisticRegressionModel()
+        previous.train(X, y)
+        model = base.LogisticRegressionModel()
+        X_changed = [x for x, label in zip(X, y) if label != y[0]]
+        y_changed = [label for label in y if label != y[0]]
+        model.techniques_model[:-1].fit(X_changed, y_changed)
+
+        # Act
+        classifier = model.warm_start_classifier(previous, y_changed)
+
+        # Assert
+        assert classifier is None
+
+    def test_warm_start_classifier_carries_over_shared_vocabulary(self):
+        # Arrange
+        X, y = base.LogisticRegressionModel().get_training_data()
+        previous = base.LogisticRegressionModel()
+        previous.train(X, y)
+        model = base.LogisticRegressionModel()
+        model.techniques_model[:-1].fit(X, y)
+
+        # Act
+        classifier = model.warm_start_classifier(previous, y)
+
+        # Assert
+        previous_classifier = previous.techniques_model.steps[-1][1]
+        assert (classifier.coef_ == previous_classifier.coef_).all()
+        assert classifier.get_params()["warm_start"]
+
+    def test_train_and_test_loads_training_data_once(self, mocker):
+        # Arrange
+        nb_model = base.NaiveBayesModel()
+        spy = mocker.spy(nb_model, "_load_training_rows")
+        timer = base.PhaseTimer()
+
+        # Act
+        nb_model.train_and_test(timer=timer)
+
+        # Assert
+        spy.assert_called_once()
+        assert list(timer.timings) == [
+            "load",
+            "preprocess",
+            "evaluate",
+            "vectorize",
+            "fit",
+        ]
+        assert nb_model.average_f1_score is not None
+        assert nb_model.last_trained is not None
+
+    def test_test_with_shared_features_matches_test_without(self):
+        # Arrange
+        model = base.NaiveBayesHashingModel()
+        X, y = model.get_training_data()
+        features = model.techniques_model[:-1].transform(X)
+
+        # Act
+        model.test(X, y)
+        expected = model.detailed_f1_score
+        model.test(X, y, features=features)
+
+        # Assert
+        assert model.detailed_f1_score == expected
+
+    def test_test_with_cross_validation_scores_every_technique(self):
+        # Arrange
+        nb_model = base.NaiveBayesModel()
+        X, y = nb_model.get_training_data()
+
+        # Act
+        nb_model.test(X, y, folds=3, n_jobs=2)
+
+        # Assert
+        assert 0.0 <= nb_model.average_f1_score <= 1.0
+        assert {score[0] for score in nb_model.detailed_f1_score} == set(y)
 
     """
     ----- Begin DummyModel Tests -----
@@ -301,3 +1180,257 @@ class TestsThatNeedTrainingData:
     """
     ----- End DummyModel Tests -----
     """
+
+
+@pytest.fixture
+def queued_jobs(user):
+    jobs = []
+    for _ in range(6):
+        with open("tests/data/simple-test.docx", "rb") as f:
+            jobs.append(db_models.DocumentProcessingJob.create_from_file(File(f), user))
+    yield jobs
+    for job in jobs:
+        job.document.delete()
+
+
+@pytest.fixture
+def file_database(tmpdir, mocker):
+    """
+    Copies the test database to a file that is used by the connections opened in
+    other threads, so that SQLite locks it as it would for worker processes. The
+    copy is made before the test writes to the database.
+    """
+    filepath = str(tmpdir / "db.sqlite3")
+    connection.ensure_connection()
+    target = sqlite3.connect(filepath)
+    connection.connection.backup(target)
+    target.close()
+    mocker.patch.dict(
+        connections.databases,
+        {
+            "default": dict(
+                connections.databases["default"],
+                NAME=filepath,
+                OPTIONS={"timeout": 20},
+            )
+        },
+    )
+    return filepath
+
+
+def run_in_threads(func, *args_list):
+    """Calls func once for each args in a thread of its own. Returns the results."""
+
+    def call(args):
+        try:
+            return func(*args)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(args_list)) as executor:
+        return list(executor.map(call, args_list))
+
+
+@pytest.mark.django_db
+class TestJobClaiming:
+    def test_several_workers_process_each_job_once(self, queued_jobs):
+        # Arrange
+        model_manager = base.ModelManager("dummy")
+        model_manager.model.train()
+        workers = [base.get_worker_id() for _ in range(3)]
+        claimed = {worker: [] for worker in workers}
+
+        # Act
+        # Each worker claims a job before any of the claimed jobs are finished
+        while True:
+            claims = [
+                (worker, base.ModelManager.claim_job(worker)) for worker in workers
+            ]
+            claims = [(worker, job) for worker, job in claims if job is not None]
+            if not claims:
+                break
+            for worker, job in claims:
+                claimed[worker].append(job.id)
+                model_manager.run_job(job, worker)
+        report_count = db_models.Report.objects.filter(
+            document__in=[job.document for job in queued_jobs]
+        ).count()
+
+        # Assert
+        assert sorted(sum(claimed.values(), [])) == [job.id for job in queued_jobs]
+        assert [len(job_ids) for job_ids in claimed.values()] == [2, 2, 2]
+        assert report_count == len(queued_jobs)
+        assert not db_models.DocumentProcessingJob.objects.exists()
+
+    def test_concurrent_workers_process_each_job_once(
+        self, file_database, settings, tmpdir
+    ):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        model = base.DummyModel()
+        model.train()
+        claimed = []
+
+        def queue_job():
+            with open("tests/data/simple-test.docx", "rb") as f:
+                document = db_models.Document.objects.create(docfile=File(f))
+            return db_models.DocumentProcessingJob.objects.create(document=document)
+
+        def worker():
+            model_manager = base.ModelManager("dummy")
+            model_manager.model = model
+            while True:
+                job = base.ModelManager.claim_job(base.get_worker_id())
+                if job is None:
+                    return
+                claimed.append(job.id)
+                model_manager.run_job(job, job.worker_id)
+
+        def get_results():
+            reports = db_models.Report.objects.filter(
+                document__in=[job.document_id for job in jobs]
+            ).order_by("document_id")
+            return (
+                list(reports.values_list("document_id", flat=True)),
+                db_models.DocumentProcessingJob.objects.count(),
+            )
+
+        jobs = run_in_threads(queue_job, *[()] * 6)
+
+        # Act
+        run_in_threads(worker, *[()] * 3)
+        [(report_document_ids, job_count)] = run_in_threads(get_results, ())
+
+        # Cleanup
+        for job in jobs:
+            job.document.docfile.delete()
+
+        # Assert
+        assert sorted(claimed) == sorted(job.id for job in jobs)
+        assert report_document_ids == sorted(job.document_id for job in jobs)
+        assert job_count == 0
+
+    def test_run_job_renews_lease_while_classifying(
+        self, queued_jobs, settings, tmpdir, mocker
+    ):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        settings.ML_INFERENCE_CHUNK_SIZE = 1
+        model_manager = base.ModelManager("dummy")
+        model_manager.model.train()
+        job = base.ModelManager.claim_job("this-worker")
+        expiring = datetime.now(timezone.utc) + timedelta(seconds=1)
+        leases = []
+        select_mappings = model_manager.model._select_mappings
+
+        def record_lease_then_select(*args):
+            # The lease as each chunk is scored, before it's set to expire again
+            leases.append(
+                db_models.DocumentProcessingJob.objects.get(id=job.id).lease_expires_on
+            )
+            db_models.DocumentProcessingJob.objects.filter(id=job.id).update(
+                lease_expires_on=expiring
+            )
+            return select_mappings(*args)
+
+        mocker.patch.object(
+            model_manager.model,
+            "_select_mappings",
+            side_effect=record_lease_then_select,
+        )
+
+        # Act
+        model_manager.run_job(job, "this-worker")
+
+        # Assert
+        assert len(leases) > 1
+        assert all(lease > expiring for lease in leases)
+
+    def test_claim_job_loses_race_for_job_to_other_worker(self, queued_jobs, mocker):
+        # Arrange
+        first = QuerySet.first
+        other_claims = []
+
+        def first_then_other_worker_claims(queryset):
+            job = first(queryset)
+            if job is not None and not other_claims:
+                # Another worker claims the job between this worker's read and update
+                other_claims.append(None)
+                other_claims[0] = base.ModelManager.claim_job("other-worker")
+            return job
+
+        mocker.patch.object(QuerySet, "first", first_then_other_worker_claims)
+
+        # Act
+        job = base.ModelManager.claim_job("this-worker")
+
+        # Assert
+        assert other_claims[0].id == queued_jobs[0].id
+        assert other_claims[0].worker_id == "other-worker"
+        assert job.id == queued_jobs[1].id
+        assert job.worker_id == "this-worker"
+        assert job.status == "processing"
+
+    def test_claim_job_reclaims_job_with_expired_lease(self, queued_jobs):
+        # Arrange
+        now = datetime.now(timezone.utc)
+        db_models.DocumentProcessingJob.objects.filter(id=queued_jobs[0].id).update(
+            status="processing",
+            worker_id="dead-worker",
+            lease_expires_on=now - timedelta(seconds=1),
+        )
+        db_models.DocumentProcessingJob.objects.exclude(id=queued_jobs[0].id).update(
+            status="processing",
+            worker_id="live-worker",
+            lease_expires_on=now + timedelta(seconds=60),
+        )
+
+        # Act
+        job = base.ModelManager.claim_job("this-worker")
+        next_job = base.ModelManager.claim_job("this-worker")
+
+        # Assert
+        assert job.id == queued_jobs[0].id
+        assert job.worker_id == "this-worker"
+        assert job.lease_expires_on > now
+        assert next_job is None
+
+    def test_run_model_keeps_reports_if_metrics_fail(
+        self, queued_jobs, settings, tmpdir, mocker
+    ):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        model_manager = base.ModelManager("dummy")
+        model_manager.model.train()
+        mocker.patch.object(
+            base.metrics, "record_job", side_effect=DatabaseError("Boom")
+        )
+
+        # Act
+        model_manager.run_model()
+        report_count = db_models.Report.objects.filter(
+            document__in=[job.document for job in queued_jobs]
+        ).count()
+
+        # Assert
+        assert report_count == len(queued_jobs)
+        assert not db_models.DocumentProcessingJob.objects.exists()
+        assert base.metrics.record_job.call_count == len(queued_jobs)
+
+    def test_run_job_discards_report_if_job_was_reclaimed(self, queued_jobs):
+        # Arrange
+        model_manager = base.ModelManager("dummy")
+        model_manager.model.train()
+        job = base.ModelManager.claim_job("slow-worker")
+        db_models.DocumentProcessingJob.objects.filter(id=job.id).update(
+            worker_id="other-worker"
+        )
+
+        # Act
+        model_manager.run_job(job, "slow-worker")
+        job.refresh_from_db()
+
+        # Assert
+        assert not db_models.Report.objects.filter(document=job.document).exists()
+        assert job.status == "processing"
+        assert job.worker_id == "other-worker"
@@ -0,0 +1,60 @@
+import pytest
+from django.core.files.base import ContentFile
+
+from tram import models as db_models
+from tram.ml import base, benchmark
+
+
+@pytest.mark.django_db
+class TestBenchmark:
+    @pytest.mark.parametrize("fmt", benchmark.FORMATS)
+    def test_synthetic_reports_can_be_extracted(self, fmt):
+        # Arrange
+        sentences = benchmark.generate_sentences(100)
+        document = db_models.Document(
+            docfile=ContentFile(benchmark.WRITERS[fmt](sentences), name="test." + fmt)
+        )
+        document.save()
+
+        # Act
+        with document.docfile.open("rb"):
+            text = base.DummyModel()._extract_text(document)
+
+        # Cleanup
+        document.delete()
+
+        # Assert
+        assert "used PowerShell" in text
+        assert len(base.DummyModel()._sentence_tokenize(text)) > 90
+
+    def test_run_times_each_stage_of_trained_models(self, settings, tmpdir):
+        # Arrange
+        settings.ML_MODEL_DIR = str(tmpdir)
+        base.ModelManager("dummy").train_model()
+
+        # Act
+        results = benchmark.run(["dummy", "nb"], n_sentences=20, repeat=1)
+
+        # Assert
+        assert list(results["results"]) == ["dummy"]
+        for result in results["results"]["dummy"].values():
+            assert result["sentences"] > 0
+            assert set(result["seconds"]) == set(benchmark.STAGES)
+        assert not db_models.Report.objects.filter(name="Benchmark report").exists()
+
+    def test_find_regressions_flags_slower_stages(self):
+        # Arrange
+        baseline = {"results": {"nb": {"txt": {"seconds": {"extract": 0.1}}}}}
+        run_results = {
+            "results": {
+                "nb": {"txt": {"seconds": {"extract": 0.2}}},
+                "logreg": {"txt": {"seconds": {"extract": 0.2}}},
+            }
+        }
+
+        # Act
+        regressions = benchmark.find_regressions(run_results, baseline)
+
+        # Assert
+        assert len(regressions) == 1
+        assert regressions[0]["model"] == "nb"
@@ -3,7 +3,7 @@ from django.core.management import call_command
 from django.core.management.base import CommandError
 
 from tram.management.commands import attackdata, pipeline
-from tram.ml import base
+from tram.ml import base, benchmark
 from tram.models import AttackObject
 
 
@@ -24,6 +24,7 @@ class TestPipeline:
         "subcommand,to_mock",
         [
             (pipeline.RUN, "run_model"),
+            (pipeline.RUN_TRAINING, "run_training_jobs"),
             (pipeline.TRAIN, "train_model"),
         ],
     )
@@ -42,6 +43,60 @@ class TestPipeline:
         with pytest.raises(CommandError):
             call_command("pipeline", "incorrect-subcommand")
 
+    @pytest.mark.parametrize(
+        "model,expected",
+        [
+            ("all", list(base.ModelManager.model_registry)),
+            ("dummy,nb", ["dummy", "nb"]),
+        ],
+    )
+    def test_train_multiple_models_calls_train_models(self, mocker, model, expected):
+        # Arrange
+        mocked_func = mocker.patch.object(
+            base.ModelManager, "train_models", return_value={}
+        )
+
+        # Act
+        call_command("pipeline", pipeline.TRAIN, model=model)
+
+        # Assert
+        mocked_func.assert_called_once_with(expected, warm_start=None)
+
+    def test_train_multiple_models_passes_warm_start(self, mocker):
+        # Arrange
+        mocked_func = mocker.patch.object(
+            base.ModelManager, "train_models", return_value={}
+        )
+
+        # Act
+        call_command("pipeline", pipeline.TRAIN, model="dummy,nb", warm_start=True)
+
+        # Assert
+        mocked_func.assert_called_once_with(["dummy", "nb"], warm_start=True)
+
+    def test_train_multiple_models_incremental_raises_commanderror(self):
+        # Act / Assert
+        with pytest.raises(CommandError):
+            call_command("pipeline", pipeline.TRAIN, model="all", incremental=True)
+
+    def test_bench_fails_on_regression(self, mocker, tmpdir):
+        # Arrange
+        baseline = tmpdir / "baseline.json"
+        baseline.write("{}")
+        mocker.patch.object(benchmark, "run", return_value={"results": {}})
+        regression = {
+            "model": "nb",
+            "format": "txt",
+            "stage": "extract",
+            "baseline_seconds": 0.1,
+            "seconds": 0.2,
+        }
+        mocker.patch.object(benchmark, "find_regressions", return_value=[regression])
+
+        # Act / Assert
+        with pytest.raises(CommandError):
+            call_command("pipeline", pipeline.BENCH, baseline=str(baseline))
+
     @pytest.mark.django_db
     def test_run_succeeds(self):
         # Act
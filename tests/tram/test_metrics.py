@@ -0,0 +1,72 @@
+import pytest
+
+from tram import models as db_models
+from tram.ml import metrics
+
+
+@pytest.mark.django_db
+class TestMetrics:
+    def test_record_job_adds_to_histogram_buckets(self):
+        # Arrange
+        timings = {
+            "seconds": {"extract": 0.5, "tokenize": 0.1, "classify": 0.2, "save": 0.4},
+            "total_seconds": 1.2,
+            "sentences": 10,
+        }
+
+        # Act
+        metrics.record_job(timings, succeeded=True)
+        metrics.record_job(timings, succeeded=True)
+        values = dict(db_models.PipelineMetric.objects.values_list("key", "value"))
+
+        # Assert
+        assert 'tram_job_processing_seconds_bucket{le="1.0"}' not in values
+        assert values['tram_job_processing_seconds_bucket{le="2.5"}'] == 2
+        assert values['tram_job_processing_seconds_bucket{le="+Inf"}'] == 2
+        assert values["tram_job_processing_seconds_count"] == 2
+        assert values["tram_job_processing_seconds_sum"] == pytest.approx(2.4)
+        assert values['tram_report_save_seconds_bucket{le="0.5"}'] == 2
+        assert values["tram_sentences_classified_total"] == 20
+        assert values["tram_classify_sentences_per_second"] == pytest.approx(50)
+        assert values['tram_jobs_processed_total{result="success"}'] == 2
+
+    def test_record_failed_job_only_counts_it(self):
+        # Act
+        metrics.record_job({"seconds": {"extract": 0.1}}, succeeded=False)
+        values = dict(db_models.PipelineMetric.objects.values_list("key", "value"))
+
+        # Assert
+        assert values == {'tram_jobs_processed_total{result="error"}': 1}
+
+    def test_render_reports_queue_depth(self, document):
+        # Arrange
+        db_models.DocumentProcessingJob.objects.create(document=document)
+        db_models.DocumentProcessingJob.objects.create(
+            document=document, status="error"
+        )
+        metrics.record_model_load("NaiveBayesModel", 0.25)
+
+        # Act
+        text = metrics.render()
+
+        # Assert
+        lines = text.splitlines()
+        assert "# TYPE tram_jobs gauge" in lines
+        assert 'tram_jobs{status="queued"} 1.0' in lines
+        assert 'tram_jobs{status="error"} 1.0' in lines
+        assert 'tram_model_load_seconds{model="NaiveBayesModel"} 0.25' in lines
+        assert 'tram_job_processing_seconds_bucket{le="+Inf"} 0.0' in lines
+        assert 'tram_jobs_processed_total{result="success"} 0.0' in lines
+        age = float(
+            next(
+                line.split()[1]
+                for line in lines
+                if line.startswith("tram_oldest_queued_job_age_seconds ")
+            )
+        )
+        assert age >= 0
+
+    def test_render_does_not_scan_reports(self, django_assert_num_queries):
+        # Act / Assert
+        with django_assert_num_queries(3):
+            metrics.render()
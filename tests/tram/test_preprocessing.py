@@ -0,0 +1,138 @@
+import pytest
+
+from tram.ml import preprocessing
+
+
+class TestLemmatizer:
+    def test_lemmatize_removes_digits(self):
+        # Arrange
+        lemmatizer = preprocessing.Lemmatizer(cache_size=10)
+
+        # Act
+        lemmatized = lemmatizer.lemmatize("APT29 used T1059 in 2020\n")
+
+        # Assert
+        assert not any(c.isdigit() for c in lemmatized)
+
+    def test_lemmatize_sentences_preserves_order(self):
+        # Arrange
+        lemmatizer = preprocessing.Lemmatizer(cache_size=10)
+        sentences = ["first sentence", "second sentence", "third sentence"]
+
+        # Act
+        lemmatized = lemmatizer.lemmatize_sentences(sentences)
+
+        # Assert
+        assert lemmatized == [lemmatizer.lemmatize(s) for s in sentences]
+
+    def test_cache_info_counts_hits_and_misses(self):
+        # Arrange
+        lemmatizer = preprocessing.Lemmatizer(cache_size=10)
+
+        # Act
+        lemmatizer.lemmatize_sentences(["the attacker", "the attacker"])
+        info = lemmatizer.cache_info()
+
+        # Assert
+        assert info.misses == 2
+        assert info.hits == 2
+        assert info.maxsize == 10
+
+    def test_get_lemmatizer_is_shared(self):
+        # Act / Assert
+        assert preprocessing.get_lemmatizer() is preprocessing.get_lemmatizer()
+
+
+class TestLemmatizeSentences:
+    def test_parallel_matches_serial(self):
+        # Arrange
+        sentences = ["attackers used %d tools" % i for i in range(10)] + [
+            "the malware encrypts files",
+            "adversaries dumped credentials",
+        ]
+
+        # Act
+        serial = preprocessing.lemmatize_sentences(sentences)
+        parallel = preprocessing.lemmatize_sentences(sentences, workers=2, chunk_size=3)
+
+        # Assert
+        assert parallel == serial
+
+
+class TestCorpusCache:
+    def test_preprocess_only_lemmatizes_new_and_changed_sentences(self, tmpdir, mocker):
+        # Arrange
+        filepath = str(tmpdir / "corpus-cache.json")
+        cache = preprocessing.CorpusCache(filepath)
+        cache.preprocess({1: ("t1", "first sentence"), 2: ("t1", "second sentence")})
+        cache.save()
+        spy = mocker.spy(preprocessing, "lemmatize_sentences")
+
+        # Act
+        cache = preprocessing.CorpusCache(filepath)
+        lemmatized = cache.preprocess(
+            {2: ("t2", "changed sentence"), 3: ("t1", "third sentence")}
+        )
+
+        # Assert
+        assert spy.call_args[0][0] == ["changed sentence", "third sentence"]
+        assert set(lemmatized) == {2, 3}
+
+    def test_preprocess_reuses_cached_sentences(self, tmpdir, mocker):
+        # Arrange
+        filepath = str(tmpdir / "corpus-cache.json")
+        cache = preprocessing.CorpusCache(filepath)
+        expected = cache.preprocess({1: ("t1", "first sentence")})
+        cache.save()
+        spy = mocker.spy(preprocessing, "lemmatize_sentences")
+
+        # Act
+        lemmatized = preprocessing.CorpusCache(filepath).preprocess(
+            {1: ("t1", "first sentence")}
+        )
+
+        # Assert
+        assert spy.call_args[0][0] == []
+        assert lemmatized == expected
+
+    def test_get_stale_ids_returns_new_and_changed_sentences(self, tmpdir):
+        # Arrange
+        cache = preprocessing.CorpusCache(str(tmpdir / "corpus-cache.json"))
+        cache.preprocess({1: ("t1", "first sentence"), 2: ("t1", "second sentence")})
+
+        # Act
+        stale_ids = cache.get_stale_ids({1: "t1", 2: "t2", 3: "t1"})
+
+        # Assert
+        assert stale_ids == [2, 3]
+
+    def test_save_leaves_cache_file_intact_if_write_fails(self, tmpdir, mocker):
+        # Arrange
+        filepath = tmpdir / "corpus-cache.json"
+        cache = preprocessing.CorpusCache(str(filepath))
+        cache.preprocess({1: ("t1", "first sentence")})
+        cache.save()
+        cache.preprocess({2: ("t1", "second sentence")})
+        mocker.patch.object(preprocessing.json, "dump", side_effect=OSError("Boom"))
+
+        # Act
+        with pytest.raises(OSError):
+            cache.save()
+
+        # Assert
+        assert tmpdir.listdir() == [filepath]
+        assert set(preprocessing.CorpusCache(str(filepath)).entries) == {1}
+
+    def test_clear_removes_cache_file(self, tmpdir):
+        # Arrange
+        filepath = tmpdir / "corpus-cache.json"
+        cache = preprocessing.CorpusCache(str(filepath))
+        cache.preprocess({1: ("t1", "first sentence")})
+        cache.save()
+
+        # Act
+        cache.clear()
+
+        # Assert
+        assert not filepath.exists()
+        assert preprocessing.CorpusCache(str(filepath)).entries == {}
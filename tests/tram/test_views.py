@@ -5,7 +5,8 @@ from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client
 
-from tram.models import Document, DocumentProcessingJob
+from tram.ml import base
+from tram.models import Document, DocumentProcessingJob, TrainingJob
 
 
 @pytest.fixture
@@ -308,6 +309,27 @@ class TestReportMappings:
         # Assert
         assert response.content == b"test file content"
 
+    def test_get_reports_slower_than(self, logged_in_client, report):
+        # Arrange
+        report.timings = {"seconds": {"extract": 2.0}, "total_seconds": 2.0}
+        report.save()
+
+        # Act
+        slow = logged_in_client.get("/api/reports/?slower-than=1").json()
+        fast = logged_in_client.get("/api/reports/?slower-than=3").json()
+
+        # Assert
+        assert [r["id"] for r in slow] == [report.id]
+        assert slow[0]["timings"]["total_seconds"] == 2.0
+        assert fast == []
+
+    def test_get_reports_slower_than_invalid_returns_400(self, logged_in_client):
+        # Act
+        response = logged_in_client.get("/api/reports/?slower-than=slow")
+
+        # Assert
+        assert response.status_code == 400  # HTTP 400 Bad Request
+
     def test_get_reports_by_doc_id(self, logged_in_client, report_with_document):
         # Act
         doc_id = report_with_document.document.id
@@ -341,12 +363,51 @@ class TestMl:
         # Assert
         assert response.status_code == 404  # HTTP 200 Ok
 
-    def test_train_model(self, logged_in_client):
+    def test_train_model(self, logged_in_client, mocker):
+        # Arrange
+        mock_train = mocker.patch.object(base.ModelManager, "train_model")
+
         # Act
         response = logged_in_client.post("/api/train-model/dummy")
+        job = TrainingJob.objects.get(id=response.json()["job_id"])
+
+        # Assert
+        assert response.status_code == 202  # HTTP 202 Accepted
+        assert job.model_key == "dummy"
+        assert job.status == "queued"
+        assert not mock_train.called
+
+    def test_train_model_incremental(self, logged_in_client):
+        # Act
+        response = logged_in_client.post("/api/train-model/nb", {"incremental": "true"})
+        job = TrainingJob.objects.get(id=response.json()["job_id"])
+
+        # Assert
+        assert response.status_code == 202  # HTTP 202 Accepted
+        assert job.incremental
+
+    def test_train_model_coalesces_queued_requests(self, logged_in_client):
+        # Act
+        first = logged_in_client.post("/api/train-model/nb", {"incremental": "true"})
+        second = logged_in_client.post("/api/train-model/nb")
+        job = TrainingJob.objects.get(id=first.json()["job_id"])
+
+        # Assert
+        assert second.json()["job_id"] == job.id
+        assert TrainingJob.objects.filter(model_key="nb").count() == 1
+        assert not job.incremental
+
+    def test_get_training_job(self, logged_in_client):
+        # Arrange
+        job_id = logged_in_client.post("/api/train-model/dummy").json()["job_id"]
+
+        # Act
+        response = logged_in_client.get(f"/api/training-jobs/{job_id}/")
 
         # Assert
         assert response.status_code == 200  # HTTP 200 Ok
+        assert response.json()["status"] == "queued"
+        assert response.json()["elapsed_sec"] is None
 
     def test_train_model_404(self, logged_in_client):
         # Act
@@ -354,3 +415,15 @@ class TestMl:
 
         # Assert
         assert response.status_code == 404  # HTTP 404 Not Found
+
+
+@pytest.mark.django_db
+class TestMetrics:
+    def test_metrics_can_be_scraped_without_login(self, client):
+        # Act
+        response = client.get("/metrics")
+
+        # Assert
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert b"# TYPE tram_job_processing_seconds histogram" in response.content
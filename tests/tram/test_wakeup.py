@@ -0,0 +1,91 @@
+import os
+import shutil
+import socket
+import tempfile
+
+import pytest
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from tram import models as db_models
+from tram.ml import wakeup
+
+
+@pytest.fixture
+def socket_dir(settings):
+    # Unix socket paths are limited to about 100 characters, so pytest's tmpdir
+    # can be too long
+    path = tempfile.mkdtemp(prefix="tram-")
+    settings.ML_WORKER_SOCKET_DIR = path
+    yield path
+    shutil.rmtree(path)
+
+
+def test_backoff_doubles_up_to_max():
+    # Arrange
+    backoff = wakeup.Backoff(1, 5)
+
+    # Act
+    intervals = [backoff.next() for _ in range(5)]
+    backoff.reset()
+
+    # Assert
+    assert intervals == [1, 2, 4, 5, 5]
+    assert backoff.next() == 1
+
+
+@pytest.mark.django_db
+class TestSocketListener:
+    def test_notify_wakes_up_each_listener(self, socket_dir):
+        # Arrange
+        listeners = [wakeup.get_listener(), wakeup.get_listener()]
+
+        # Act
+        wakeup.notify()
+        wakeup.notify()
+        notified = [listener.wait(5) for listener in listeners]
+        notified_again = [listener.wait(0.01) for listener in listeners]
+
+        # Cleanup
+        for listener in listeners:
+            listener.close()
+
+        # Assert
+        assert all(isinstance(lst, wakeup.SocketListener) for lst in listeners)
+        assert notified == [True, True]
+        assert notified_again == [False, False]
+        assert os.listdir(socket_dir) == []
+
+    def test_notify_removes_sockets_of_dead_workers(self, socket_dir):
+        # Arrange
+        path = os.path.join(socket_dir, "dead.sock")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        sock.close()
+
+        # Act
+        wakeup.notify()
+
+        # Assert
+        assert not os.path.exists(path)
+
+    def test_queued_job_notifies_workers_on_commit(self, mocker):
+        # Arrange
+        notify = mocker.patch("tram.ml.wakeup.notify")
+        document = db_models.Document(docfile=ContentFile(b"text", name="test.txt"))
+        document.save()
+
+        # Act
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            job = db_models.DocumentProcessingJob.objects.create(document=document)
+            notified_before_commit = notify.called
+        job.status = "error"
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            job.save()
+
+        # Cleanup
+        document.delete()
+
+        # Assert
+        assert not notified_before_commit
+        assert notify.call_count == 1